@@ -0,0 +1,134 @@
+import datetime
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import request_started
+from django.dispatch import receiver
+from django.views.decorators.http import condition
+from django.views.decorators.vary import vary_on_cookie
+
+from . import metrics
+
+CACHE_TIMEOUT = 60 * 60 * 24
+COUNTERS = ['request_hits', 'cache_hits', 'misses']
+# Version of all betting data, whatever year it belongs to
+ALL = 'all'
+# Pages also change when games start and deadlines pass, so their ETags change at least this often
+PAGE_INTERVAL = 5 * 60
+
+_local = threading.local()
+
+
+def request_memo():
+    ''' Returns the values memoized during the current request '''
+    if not hasattr(_local, 'memo'):
+        _local.memo = {}
+    return _local.memo
+
+
+@receiver(request_started)
+def reset_request_memo(sender, **kwargs):
+    _local.memo = {}
+
+
+def version_key(year):
+    return f'betting:version:{year}'
+
+
+def get_version(year):
+    ''' Returns the current version of the cached betting data of the year
+
+    The version is a timestamp in milliseconds, so it doubles as the last modification time of the data.
+    '''
+    key = version_key(year)
+    memo = request_memo()
+    if key not in memo:
+        version = cache.get(key)
+        if version is None:
+            cache.add(key, int(time.time() * 1000), None)
+            version = cache.get(key)
+        memo[key] = version
+    return memo[key]
+
+
+def current_version(year):
+    ''' Returns the version of the year in the shared cache, ignoring the version memoized during the request '''
+    return cache.get(version_key(year))
+
+
+def bump_version(year=ALL):
+    ''' Moves the cached betting data of the year, and of all years, to a new version, which leaves all old entries unused
+
+    The new version is the current time, or one more than the old version if that is later. The backend compares and
+    writes it in one transaction, so workers bumping at once each get a version of their own without moving it into
+    the future, where the later changes would not move the last modification time of the pages past what clients have.
+    '''
+    memo = {}
+    now = int(time.time() * 1000)
+    for key in {version_key(year), version_key(ALL)}:
+        if hasattr(cache, 'advance'):
+            version = cache.advance(key, now, None)
+        else:
+            # Other backends have no such transaction, so concurrent bumps may end up at the same version there
+            version = max((cache.get(key) or 0) + 1, now)
+            cache.set(key, version, None)
+        memo[key] = version
+    _local.memo = memo
+
+
+def count(counter):
+    ''' Counts a lookup in the memory of this process, without writing to the shared cache '''
+    metrics.CACHE_LOOKUPS.inc(result=counter)
+
+
+def cache_stats():
+    ''' Returns the hit and miss counters of the betting cache, added up over all workers '''
+    lookups = metrics.collect().get(metrics.CACHE_LOOKUPS.name, {})
+    stats = {counter: lookups.get(metrics.CACHE_LOOKUPS.key({'result': counter}), 0) for counter in COUNTERS}
+    lookups = sum(stats.values())
+    stats['hit_ratio'] = (stats['request_hits'] + stats['cache_hits']) / lookups if lookups else None
+    return stats
+
+
+def cached(name, year, *parts, compute):
+    ''' Returns the value computed by compute for the current version of the year, from the request or the shared cache if possible '''
+    key = ':'.join(['betting', name, str(year), *(str(part) for part in parts), str(get_version(year))])
+    memo = request_memo()
+    if key in memo:
+        count('request_hits')
+        return memo[key]
+
+    value = cache.get(key)
+    if value is None:
+        count('misses')
+        value = compute()
+        cache.set(key, value, CACHE_TIMEOUT)
+    else:
+        count('cache_hits')
+
+    memo[key] = value
+    return value
+
+
+def page_state(request):
+    ''' Returns the version of all betting data, a hash of the session and the current page interval, without any query '''
+    session_key = request.COOKIES.get(settings.SESSION_COOKIE_NAME, '')
+    session = hashlib.sha256(session_key.encode()).hexdigest()[:16]
+    return get_version(ALL), session, int(time.time()) // PAGE_INTERVAL
+
+
+def page_etag(request, *args, **kwargs):
+    return '-'.join(str(part) for part in page_state(request))
+
+
+def page_last_modified(request, *args, **kwargs):
+    version, _, interval = page_state(request)
+    return datetime.datetime.fromtimestamp(max(version / 1000, interval * PAGE_INTERVAL), tz=datetime.timezone.utc)
+
+
+def conditional_page(view):
+    ''' Answers conditional GET requests for a page with 304 while the betting data, the session and the page interval are unchanged '''
+    return vary_on_cookie(condition(etag_func=page_etag, last_modified_func=page_last_modified)(view))
@@ -0,0 +1,181 @@
+''' A cache backend in a local SQLite file, shared by all worker processes of the host
+
+Entries expire after their timeout, and once the cache holds more than MAX_ENTRIES the least recently used
+1 / CULL_FREQUENCY of them are evicted. Adding, incrementing and advancing run in a single transaction, so version
+bumps and counters stay atomic across workers.
+'''
+import os
+import pickle
+import sqlite3
+import stat
+import threading
+import time
+from contextlib import contextmanager
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.exceptions import ImproperlyConfigured
+
+# Reads refresh the access time of an entry at most this often, so most reads do not write
+ACCESS_RESOLUTION = 60
+# The number of entries is checked once per this many writes of a process
+CULL_EVERY = 100
+BUSY_TIMEOUT = 5
+
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL, accessed REAL NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)',
+]
+
+
+def create_private_file(path):
+    ''' Creates the cache file readable by the current user only, refusing a file someone else created
+
+    Entries are unpickled, so whoever can write the file can run code as the web server, and they hold user objects.
+    SQLite gives its -wal and -shm files the permissions of the database file.
+    '''
+    descriptor = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        status = os.fstat(descriptor)
+        if status.st_uid != os.geteuid():
+            raise ImproperlyConfigured(f'The cache file {path} belongs to another user')
+        if stat.S_IMODE(status.st_mode) & 0o077:
+            os.fchmod(descriptor, 0o600)
+    finally:
+        os.close(descriptor)
+
+
+class SQLiteCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        self.location = str(location)
+        self._local = threading.local()
+        self._writes = 0
+
+    def _connection(self):
+        ''' Returns the connection of the current thread, opening a new one in threads and in forked processes '''
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            directory = os.path.dirname(self.location)
+            if directory:
+                os.makedirs(directory, mode=0o700, exist_ok=True)
+            create_private_file(self.location)
+            connection = sqlite3.connect(self.location, timeout=BUSY_TIMEOUT, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            for statement in SCHEMA:
+                connection.execute(statement)
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def _row(self, connection, key, now):
+        row = connection.execute('SELECT value, expires, accessed FROM cache WHERE key = ?', (key,)).fetchone()
+        if row is None or (row[1] is not None and row[1] <= now):
+            return None
+        return row
+
+    def get(self, key, default=None, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        connection = self._connection()
+        now = time.time()
+        row = self._row(connection, key, now)
+        if row is None:
+            return default
+        if row[2] < now - ACCESS_RESOLUTION:
+            connection.execute('UPDATE cache SET accessed = ? WHERE key = ?', (now, key))
+        return pickle.loads(row[0])
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        connection = self._connection()
+        connection.execute(
+            'INSERT OR REPLACE INTO cache (key, value, expires, accessed) VALUES (?, ?, ?, ?)',
+            (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), self.get_backend_timeout(timeout), time.time())
+        )
+        self._maybe_cull(connection)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        ''' Stores the value unless the key holds an unexpired one, in a single statement '''
+        key = self.make_and_validate_key(key, version=version)
+        connection = self._connection()
+        now = time.time()
+        cursor = connection.execute(
+            'INSERT INTO cache (key, value, expires, accessed) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT (key) DO UPDATE SET value = excluded.value, expires = excluded.expires, accessed = excluded.accessed '
+            'WHERE cache.expires IS NOT NULL AND cache.expires <= ?',
+            (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), self.get_backend_timeout(timeout), now, now)
+        )
+        self._maybe_cull(connection)
+        return cursor.rowcount > 0
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        now = time.time()
+        cursor = self._connection().execute(
+            'UPDATE cache SET expires = ?, accessed = ? WHERE key = ? AND (expires IS NULL OR expires > ?)',
+            (self.get_backend_timeout(timeout), now, key, now)
+        )
+        return cursor.rowcount > 0
+
+    def delete(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        return self._connection().execute('DELETE FROM cache WHERE key = ?', (key,)).rowcount > 0
+
+    def has_key(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        return self._row(self._connection(), key, time.time()) is not None
+
+    @contextmanager
+    def _write_transaction(self):
+        ''' Yields the connection inside a transaction holding the write lock, so nothing changes between a read and a write '''
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield connection
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+    def incr(self, key, delta=1, version=None):
+        ''' Adds delta to the value of the key in a write transaction, so concurrent increments are never lost '''
+        key = self.make_and_validate_key(key, version=version)
+        with self._write_transaction() as connection:
+            row = self._row(connection, key, time.time())
+            if row is None:
+                raise ValueError(f"Key '{key}' not found")
+            value = pickle.loads(row[0]) + delta
+            connection.execute('UPDATE cache SET value = ? WHERE key = ?', (pickle.dumps(value, pickle.HIGHEST_PROTOCOL), key))
+        return value
+
+    def advance(self, key, minimum, timeout=DEFAULT_TIMEOUT, version=None):
+        ''' Moves the value of the key to one more than before, or to minimum if that is larger, in a write transaction
+
+        A missing key is set to minimum. Concurrent calls each get a value of their own, and none of them goes
+        further past minimum than the number of calls.
+        '''
+        key = self.make_and_validate_key(key, version=version)
+        with self._write_transaction() as connection:
+            now = time.time()
+            row = self._row(connection, key, now)
+            value = minimum if row is None else max(pickle.loads(row[0]) + 1, minimum)
+            connection.execute(
+                'INSERT OR REPLACE INTO cache (key, value, expires, accessed) VALUES (?, ?, ?, ?)',
+                (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), self.get_backend_timeout(timeout), now)
+            )
+        return value
+
+    def clear(self):
+        self._connection().execute('DELETE FROM cache')
+
+    def _maybe_cull(self, connection):
+        self._writes += 1
+        if self._writes % CULL_EVERY:
+            return
+        connection.execute('DELETE FROM cache WHERE expires IS NOT NULL AND expires <= ?', (time.time(),))
+        count = connection.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+        if count > self._max_entries:
+            connection.execute(
+                'DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed LIMIT ?)',
+                (count // self._cull_frequency if self._cull_frequency else count,)
+            )
@@ -0,0 +1,68 @@
+import datetime
+from itertools import groupby
+
+from django.db.models import Count, Max, Min
+
+from .cache import cached, get_version
+from .models import Game, Bet
+
+
+def chart_state(competition_id, current_datetime):
+    ''' Returns the number of started games of the competition and the last modification time of its chart data '''
+    started = Game.objects.filter(competition=competition_id, start_time__lt=current_datetime).aggregate(
+        count=Count('id'),
+        first_start_time=Min('start_time'),
+        last_start_time=Max('start_time'),
+    )
+    if not started['count']:
+        return 0, None
+
+    version = max(get_version(year) for year in range(started['first_start_time'].year, started['last_start_time'].year + 1))
+    last_modified = max(datetime.datetime.fromtimestamp(version / 1000, tz=datetime.timezone.utc), started['last_start_time'])
+    return started['count'], last_modified
+
+
+def get_chart_data(competition_id, current_datetime, encoding='absolute'):
+    ''' Returns the chart data of the competition, cached until the results change or another game starts '''
+    started_games, last_modified = chart_state(competition_id, current_datetime)
+    return cached(
+        'chart', current_datetime.year, competition_id, started_games, last_modified and last_modified.timestamp(), encoding,
+        compute=lambda: build_chart_data(competition_id, current_datetime, encoding)
+    )
+
+
+def build_chart_data(competition_id, current_datetime, encoding='absolute'):
+    ''' Returns the cumulative points per user in the started games of the competition
+
+    All users share one list of labels. Each dataset holds the integer totals of a user from the label of its
+    first bet (the offset), carried forward over games without a bet. With the delta encoding every value
+    after the first one is the difference to the previous value.
+    '''
+    bets = Bet.objects.filter(
+        game__competition=competition_id,
+        game__start_time__lt=current_datetime
+    ).values_list('game__start_time', 'user_id', 'user__first_name', 'points').order_by('game__start_time')
+
+    labels = []
+    totals = {}
+    datasets = {}
+    for start_time, label_bets in groupby(bets, key=lambda bet: bet[0].replace(second=0, microsecond=0)):
+        labels.append(start_time.strftime('%Y-%m-%d %H:%M'))
+        for _, user_id, first_name, points in label_bets:
+            if user_id not in datasets:
+                datasets[user_id] = {'label': first_name, 'offset': len(labels) - 1, 'data': []}
+                totals[user_id] = 0
+            totals[user_id] += points
+        for user_id, dataset in datasets.items():
+            dataset['data'].append(totals[user_id])
+
+    if encoding == 'delta':
+        for dataset in datasets.values():
+            data = dataset['data']
+            dataset['data'] = data[:1] + [value - previous for previous, value in zip(data, data[1:])]
+
+    return {
+        'encoding': encoding,
+        'labels': labels,
+        'datasets': [datasets[user_id] for user_id in sorted(datasets)],
+    }
@@ -0,0 +1,314 @@
+from array import array
+from bisect import bisect_left
+from contextlib import contextmanager
+from itertools import groupby
+from operator import itemgetter
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+
+from .cache import ALL, bump_version, cached, current_version, get_version
+from .models import Competition, Bet, Game, StandingPrediction, Standing, LeaderboardSnapshot, BetDeadline
+
+SNAPSHOT_FIELDS = ['game_points', 'goal_difference', 'goals_scored', 'table_points', 'extra_bet', 'total_score', 'position']
+
+
+def compute_leaderboards(games):
+    ''' Computes the leaderboards of many games with a single pass over the bets of their seasons '''
+    indexes = {}
+    leaderboards = {}
+    for game in games:
+        scope = LeaderboardIndex.scope_of(game)
+        if scope not in indexes:
+            indexes[scope] = LeaderboardIndex(*scope)
+        leaderboards[game] = indexes[scope].leaderboard_for(game)
+
+    return leaderboards
+
+
+class LeaderboardIndex:
+    ''' Cumulative points, goal difference and goals scored per user over the ordered games of a season
+
+    The totals after the first k game start times are stored at index k of one array per user and value,
+    so the leaderboard at the start of any game is a lookup instead of an aggregation over all bets.
+    '''
+
+    def __init__(self, scope, key):
+        self.scope = scope
+        self.key = key
+        User = get_user_model()
+        self.users = {user.id: user for user in User.objects.all()}
+        self.table_points = {}
+        self.start_times = []
+        self.first_step = {}
+        self.cumulative = {}
+
+        bets = Bet.objects.all()
+        if scope == 'competition':
+            bets = bets.filter(game__competition=key)
+        else:
+            bets = bets.filter(game__start_time__year=key)
+        bets = bets.values_list(
+            'game__start_time', 'user_id', 'points', 'home_goals', 'away_goals',
+            'game__home_team_id', 'game__home_goals', 'game__away_goals'
+        ).order_by('game__start_time')
+
+        totals = {}
+        for start_time, step_bets in groupby(bets, key=itemgetter(0)):
+            for _, user_id, points, home_goals, away_goals, home_team_id, game_home_goals, game_away_goals in step_bets:
+                if scope == 'competition':
+                    goal_difference = 0
+                    goals_scored = home_goals - game_home_goals + away_goals - game_away_goals
+                elif home_team_id == 1:
+                    goal_difference = (game_away_goals - game_home_goals) - (away_goals - home_goals)
+                    goals_scored = home_goals - game_home_goals
+                else:
+                    goal_difference = (game_home_goals - game_away_goals) - (home_goals - away_goals)
+                    goals_scored = away_goals - game_away_goals
+                user_totals = totals.setdefault(user_id, [0, 0, 0])
+                user_totals[0] += points
+                user_totals[1] += goal_difference
+                user_totals[2] += goals_scored
+                self.first_step.setdefault(user_id, len(self.start_times))
+
+            self.start_times.append(start_time)
+            for user_id, user_totals in totals.items():
+                if user_id not in self.cumulative:
+                    self.cumulative[user_id] = tuple(array('i', [0]) * len(self.start_times) for _ in user_totals)
+                for values, value in zip(self.cumulative[user_id], user_totals):
+                    values.append(value)
+
+        years = {key} if scope == 'year' else {start_time.year for start_time in self.start_times}
+        for year in years:
+            self.table_points[year] = get_table_points(year)
+
+    @classmethod
+    def for_game(cls, game):
+        ''' Returns the index of the season the leaderboard of the game belongs to '''
+        return cls(*cls.scope_of(game))
+
+    @staticmethod
+    def scope_of(game):
+        ''' Returns the scope of the bets counted in the leaderboard of the game '''
+        return ('competition', game.competition_id) if game.competition.excluded else ('year', game.start_time.year)
+
+    def step_of(self, game):
+        ''' Returns the number of game start times before the start of the game '''
+        return bisect_left(self.start_times, game.start_time)
+
+    def leaderboard_for(self, game):
+        ''' Returns the leaderboard at the start of the game '''
+        return self.leaderboard_at(self.step_of(game), game.start_time.year)
+
+    def leaderboard_at(self, step, year):
+        ''' Returns the leaderboard after the given number of game start times '''
+        if year not in self.table_points:
+            self.table_points[year] = get_table_points(year)
+
+        user_ids = sorted(user_id for user_id, first_step in self.first_step.items() if first_step < step)
+        if user_ids:
+            rows = [(self.users[user_id], *(values[step] for values in self.cumulative[user_id])) for user_id in user_ids]
+        else:
+            rows = [(user, 0, 0, 0) for user in self.users.values()]
+
+        leaderboard = []
+        for user, game_points, goal_difference, goals_scored in rows:
+            user_table_points = self.table_points[year].get(user, {})
+            row = {
+                'user': user,
+                'game_points': game_points,
+                'goal_difference': goal_difference,
+                'goals_scored': goals_scored,
+                'table_points': user_table_points.get('points', 0),
+                'extra_bet': user_table_points.get('extra_bet', 0),
+            }
+            row['total_score'] = row['game_points'] + row['table_points'] + row['extra_bet']
+            leaderboard.append(row)
+
+        return rank_leaderboard(leaderboard)
+
+
+def get_leaderboard_index(game):
+    ''' Returns the index of the season of the game, cached for the current data version '''
+    scope, key = LeaderboardIndex.scope_of(game)
+    return cached('leaderboard-index', index_year(game), scope, key, compute=lambda: LeaderboardIndex(scope, key))
+
+
+def index_year(game):
+    ''' Returns the year whose version the index of the game is cached for
+
+    Competitions outside the Allsvenskan can span two years, so their index follows the version of all years.
+    '''
+    scope, key = LeaderboardIndex.scope_of(game)
+    return key if scope == 'year' else ALL
+
+
+def get_table_points(year):
+    ''' Returns the table points and extra bet points per user for the Allsvenskan season of the year '''
+    competition = Competition.objects.get(name='Allsvenskan', season=year)
+    try:
+        standings = Standing.objects.filter(competition=competition).latest('round')
+    except Standing.DoesNotExist:
+        standings = Standing.objects.create(competition=competition, round=1, top_scorer='N/A', most_assists='N/A')
+
+    top_scorer_list = standings.top_scorer
+    most_assists_list = standings.most_assists
+
+    user_standing_predictions = StandingPrediction.objects.select_related('user').filter(competition=competition)
+    table_points = {}
+    for user_standing_prediction in user_standing_predictions:
+        user = user_standing_prediction.user
+        user_top_scorers = user_standing_prediction.top_scorer.split(', ')
+        user_most_assists = user_standing_prediction.most_assists.split(', ')
+
+        extra_bet = 0
+
+        if user_top_scorers == []:
+            for user_top_scorer in user_top_scorers:
+                if user_top_scorer in top_scorer_list:
+                    extra_bet += 6
+        if user_most_assists == []:
+            for user_most_assist in user_most_assists:
+                if user_most_assist in most_assists_list:
+                    extra_bet += 16
+
+        table_points[user] = {
+            'points': 0,
+            'extra_bet': extra_bet
+        }
+
+    return table_points
+
+
+def rank_leaderboard(leaderboard):
+    ''' Sorts the leaderboard rows and assigns a position to each of them '''
+    leaderboard = sorted(
+        leaderboard,
+        key=lambda x: (
+            -x['total_score'],
+            abs(x['goal_difference']),
+            abs(x['goals_scored'])
+        )
+    )
+
+    # Check if there are ties in the leaderboard and assign the same position
+    for i in range(0, len(leaderboard)):
+        current = leaderboard[i]
+        previous = leaderboard[i - 1]
+        if (current['total_score'] == previous['total_score'] and
+            current['goal_difference'] == previous['goal_difference'] and
+            current['goals_scored'] == previous['goals_scored']):
+            current['position'] = previous.get('position', 1)
+        else:
+            current['position'] = i + 1
+
+    return leaderboard
+
+
+def get_leaderboard(game):
+    ''' Returns the stored leaderboard snapshot of the game, computing and storing it if missing '''
+    snapshots = LeaderboardSnapshot.objects.select_related('user').filter(game=game).order_by('pk')
+    leaderboard = [
+        {'user': snapshot.user, **{field: getattr(snapshot, field) for field in SNAPSHOT_FIELDS}}
+        for snapshot in snapshots
+    ]
+    if leaderboard:
+        return leaderboard
+
+    year = index_year(game)
+    version = get_version(year)
+    leaderboard = get_leaderboard_index(game).leaderboard_for(game)
+    with storing_unless_changed({year: version}):
+        store_snapshots({game: leaderboard})
+    return leaderboard
+
+
+@contextmanager
+def storing_unless_changed(versions):
+    ''' Stores what was computed at the given {year: version} in a transaction, rolled back if any of the versions moved on
+
+    Whatever was computed while a bet or game was saved is then never stored after invalidate_leaderboards: the
+    inserts hold the write lock until the check, so the invalidation either moves the version before the check or
+    deletes the rows after the commit.
+    '''
+    with transaction.atomic():
+        yield
+        if any(current_version(year) != version for year, version in versions.items()):
+            transaction.set_rollback(True)
+
+
+def store_snapshots(leaderboards):
+    ''' Persists computed leaderboards as the snapshots of their games '''
+    LeaderboardSnapshot.objects.bulk_create(
+        [
+            LeaderboardSnapshot(game=game, user=row['user'], **{field: row[field] for field in SNAPSHOT_FIELDS})
+            for game, leaderboard in leaderboards.items()
+            for row in leaderboard
+        ],
+        ignore_conflicts=True
+    )
+
+
+def get_deadlines(game):
+    ''' Returns the stored deadlines of the game, calculating them from the leaderboard if missing '''
+    deadlines = {
+        bet_deadline.user: bet_deadline.deadline
+        for bet_deadline in BetDeadline.objects.select_related('user').filter(game=game).order_by('pk')
+    }
+    if deadlines:
+        return deadlines
+
+    version = current_version(game.start_time.year)
+    deadlines = game.calculate_deadlines(get_leaderboard(game))
+    with storing_unless_changed({game.start_time.year: version}):
+        store_deadlines({game: deadlines})
+    return deadlines
+
+
+def store_deadlines(deadlines):
+    ''' Persists calculated deadlines, given as {game: {user: deadline}} '''
+    BetDeadline.objects.bulk_create(
+        [
+            BetDeadline(game=game, user=user, deadline=deadline)
+            for game, game_deadlines in deadlines.items()
+            for user, deadline in game_deadlines.items()
+        ],
+        ignore_conflicts=True
+    )
+
+
+def get_deadlines_for_games(games):
+    ''' Returns the deadlines of many games from the cached leaderboard indexes, without storing anything
+
+    Listing pages are requested right after every saved bet, so storing here would rewrite the deadlines of the season
+    under the write lock on each of them. Started games use their stored deadlines when the detail page has kept them.
+    '''
+    deadlines = {game: {} for game in games}
+    started_games = {game.id: game for game in games if game.has_started()}
+    for bet_deadline in BetDeadline.objects.select_related('user').filter(game__in=started_games).order_by('pk'):
+        deadlines[started_games[bet_deadline.game_id]][bet_deadline.user] = bet_deadline.deadline
+
+    for game, game_deadlines in deadlines.items():
+        if not game_deadlines:
+            deadlines[game] = game.calculate_deadlines(get_leaderboard_index(game).leaderboard_for(game))
+
+    return deadlines
+
+
+def invalidate_leaderboards(year, after=None):
+    ''' Moves the cache of the year to a new version and removes its snapshots and deadlines, optionally only after a point in time
+
+    Inside a transaction both are done again once it commits, since readers may have stored what they computed from
+    the data before the commit in the meantime.
+    '''
+    def invalidate():
+        bump_version(year)
+        games = Game.objects.filter(start_time__year=year)
+        if after is not None:
+            games = games.filter(start_time__gt=after)
+        LeaderboardSnapshot.objects.filter(game__in=games).delete()
+        BetDeadline.objects.filter(game__in=games).delete()
+
+    invalidate()
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(invalidate)
@@ -0,0 +1,114 @@
+''' Shared helpers of the benchmark commands, which run against a throwaway test database '''
+import io
+import statistics
+import time
+from contextlib import contextmanager
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client
+from django.test.runner import DiscoverRunner
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+from django.utils import timezone
+
+from betting.middleware import QueryTimer
+from betting.models import Competition, Game, Team
+from betting.views import deadline_calendar_token
+
+
+@contextmanager
+def test_database(name=None):
+    ''' Runs the block against a newly created test database, so the real database is never touched
+
+    SQLite test databases live in memory unless a file name is given, which concurrent load needs to see real locking.
+    '''
+    setup_test_environment()
+    if name:
+        connection.settings_dict['TEST']['NAME'] = name
+    runner = DiscoverRunner(verbosity=0, interactive=False)
+    old_config = runner.setup_databases()
+    try:
+        yield
+    finally:
+        runner.teardown_databases(old_config)
+        teardown_test_environment()
+
+
+def seed(users, **options):
+    ''' Replaces all data with a freshly seeded dataset and returns a staff user of it '''
+    call_command('flush', interactive=False, verbosity=0)
+    cache.clear()
+    arguments = ['--users', str(users)]
+    for option, value in options.items():
+        arguments += [f'--{option.replace("_", "-")}', str(value)]
+    call_command('seed_betting', *arguments, stdout=io.StringIO())
+    user = get_user_model().objects.order_by('pk').first()
+    user.is_staff = user.is_superuser = True
+    user.save(update_fields=['is_staff', 'is_superuser'])
+    return user
+
+
+def routes(user):
+    ''' Returns the name and URL of every page of betting/urls.py that can be requested with GET without side effects
+
+    The standing prediction form and the suggestions are left out, they only work on the predictions of 2023.
+    '''
+    now = timezone.now()
+    competition = Competition.objects.filter(season=str(now.year), excluded=False).order_by('pk').first()
+    game = Game.objects.filter(competition=competition).order_by('start_time').last()
+    team = Team.objects.get(pk=1)
+    competition_urls = [
+        'list-standing-prediction', 'table-bet', 'table-bet-summary',
+        'competition-overview', 'chart-data-view', 'world-cup-bet',
+    ]
+    return [
+        ('login', reverse('betting:login')),
+        ('index', reverse('betting:index')),
+        ('list-team', reverse('betting:list-team')),
+        ('create-team', reverse('betting:create-team')),
+        ('update-team', reverse('betting:update-team', args=[team.pk])),
+        ('create-game', reverse('betting:create-game')),
+        ('update-game', reverse('betting:update-game', args=[game.pk])),
+        ('detail', reverse('betting:detail', args=[game.pk])),
+        ('list-standings', reverse('betting:list-standings')),
+        ('statistics', reverse('betting:statistics', args=[now.year])),
+        ('calendar', reverse('betting:calendar')),
+        ('deadline-calendar', reverse('betting:deadline-calendar', args=[deadline_calendar_token(user)])),
+        *((name, reverse(f'betting:{name}', args=[competition.pk])) for name in competition_urls),
+        ('cache-stats', reverse('betting:cache-stats')),
+    ]
+
+
+def logged_in_client(user, raise_request_exception=False):
+    client = Client(raise_request_exception=raise_request_exception)
+    client.force_login(user)
+    return client
+
+
+def measure(client, url, **headers):
+    ''' Requests the URL and returns its status, query counts, SQL time, wall time and response size '''
+    timer = QueryTimer()
+    with connection.execute_wrapper(timer):
+        started = time.perf_counter()
+        response = client.get(url, **headers)
+        content = b''.join(response.streaming_content) if response.streaming else response.content
+        wall_time = time.perf_counter() - started
+    return {
+        'status': response.status_code,
+        'queries': timer.queries,
+        'selects': timer.selects,
+        'sql_ms': round(timer.time * 1000, 3),
+        'wall_ms': round(wall_time * 1000, 3),
+        'bytes': len(content),
+    }
+
+
+def percentiles(latencies, points=(50, 95, 99)):
+    ''' Returns the given percentiles of the latencies, or None for each of them without enough latencies '''
+    if len(latencies) < 2:
+        return {f'p{point}': latencies[0] if latencies else None for point in points}
+    cut_points = statistics.quantiles(latencies, n=100, method='inclusive')
+    return {f'p{point}': round(cut_points[point - 1], 3) for point in points}
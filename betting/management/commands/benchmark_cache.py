@@ -0,0 +1,97 @@
+import json
+import multiprocessing
+import random
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import import_string
+
+from ._harness import percentiles
+
+BACKENDS = {
+    'sqlite': ('betting.cache_backend.SQLiteCache', 'cache.sqlite3'),
+    'file': ('django.core.cache.backends.filebased.FileBasedCache', 'files'),
+}
+COUNTER_KEY = 'benchmark:counter'
+
+
+def open_cache(backend, location):
+    path, _ = BACKENDS[backend]
+    return import_string(path)(location, {'TIMEOUT': 300, 'OPTIONS': {'MAX_ENTRIES': 100000}})
+
+
+def run_worker(backend, location, operations, keys, value_size, seed):
+    ''' Runs a mix of reads, writes and counter increments and returns their latencies in microseconds '''
+    cache = open_cache(backend, location)
+    generator = random.Random(seed)
+    value = b'x' * value_size
+    latencies = {'get': [], 'set': [], 'incr': []}
+    errors = 0
+    for _ in range(operations):
+        draw = generator.random()
+        operation = 'get' if draw < 0.8 else 'set' if draw < 0.95 else 'incr'
+        key = f'benchmark:{generator.randrange(keys)}'
+        started = time.perf_counter()
+        try:
+            if operation == 'get':
+                cache.get(key)
+            elif operation == 'set':
+                cache.set(key, value)
+            else:
+                cache.incr(COUNTER_KEY)
+        except Exception:
+            errors += 1
+        latencies[operation].append((time.perf_counter() - started) * 1_000_000)
+    return latencies, errors
+
+
+class Command(BaseCommand):
+    help = 'Compares the SQLite cache backend with the file based cache under concurrent worker processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=4)
+        parser.add_argument('--operations', type=int, default=5000, help='Operations per process')
+        parser.add_argument('--keys', type=int, default=500)
+        parser.add_argument('--value-size', type=int, default=2000, help='Bytes per cached value')
+        parser.add_argument('--backends', nargs='+', choices=list(BACKENDS), default=list(BACKENDS))
+        parser.add_argument('--output', help='Write the JSON report to this file instead of standard output')
+
+    def handle(self, *args, **options):
+        report = {'processes': options['processes'], 'operations': options['operations'], 'backends': {}}
+        context = multiprocessing.get_context('fork')
+        for backend in options['backends']:
+            with tempfile.TemporaryDirectory() as directory:
+                location = f'{directory}/{BACKENDS[backend][1]}'
+                cache = open_cache(backend, location)
+                cache.set(COUNTER_KEY, 0, None)
+                for i in range(options['keys']):
+                    cache.set(f'benchmark:{i}', b'x' * options['value_size'])
+
+                started = time.perf_counter()
+                with context.Pool(options['processes']) as pool:
+                    results = pool.starmap(run_worker, [
+                        (backend, location, options['operations'], options['keys'], options['value_size'], seed)
+                        for seed in range(options['processes'])
+                    ])
+                seconds = time.perf_counter() - started
+
+                increments = sum(len(latencies['incr']) for latencies, _ in results)
+                report['backends'][backend] = {
+                    'seconds': round(seconds, 3),
+                    'operations_per_second': round(options['processes'] * options['operations'] / seconds),
+                    'errors': sum(errors for _, errors in results),
+                    'lost_increments': increments - cache.get(COUNTER_KEY, 0),
+                    **{
+                        f'{operation}_us': percentiles([latency for latencies, _ in results for latency in latencies[operation]])
+                        for operation in ('get', 'set', 'incr')
+                    },
+                }
+            self.stderr.write(f'Measured the {backend} cache')
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output)
+        else:
+            self.stdout.write(output)
@@ -0,0 +1,124 @@
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, close_old_connections, connection, connections, transaction
+from django.db.models import Count, Sum
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from betting.models import Bet
+
+from ._harness import percentiles, seed, test_database
+
+# Django's SQLite defaults: rollback journal, a new connection per request and deferred transactions
+CONFIGURATIONS = {
+    'before': {'journal_mode': 'DELETE', 'pragmas': {}, 'conn_max_age': 0, 'transaction_mode': None},
+    'after': {'journal_mode': 'WAL', 'pragmas': settings.SQLITE_PRAGMAS, 'conn_max_age': 60, 'transaction_mode': 'IMMEDIATE'},
+}
+
+
+class Command(BaseCommand):
+    help = 'Measures concurrent bet writes and leaderboard reads on SQLite with the default and the tuned connection setup'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--writers', type=int, default=4, help='Threads submitting bets')
+        parser.add_argument('--readers', type=int, default=8, help='Threads reading totals like the leaderboard pages')
+        parser.add_argument('--operations', type=int, default=200, help='Operations per thread')
+        parser.add_argument('--output', help='Write the JSON report to this file instead of standard output')
+
+    def handle(self, *args, **options):
+        report = {key: options[key] for key in ('users', 'writers', 'readers', 'operations')}
+        with tempfile.TemporaryDirectory() as directory, test_database(os.path.join(directory, 'benchmark.sqlite3')):
+            seed(options['users'], seasons=1)
+            bet_ids = list(Bet.objects.values_list('pk', flat=True))
+            for name, configuration in CONFIGURATIONS.items():
+                report[name] = self.run(configuration, bet_ids, options)
+                self.stderr.write(f'Measured {name}')
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output)
+        else:
+            self.stdout.write(output)
+
+    def run(self, configuration, bet_ids, options):
+        ''' Runs writers and readers at once, like a burst of bets before a deadline while others refresh the pages '''
+        settings_dict = connection.settings_dict
+        settings_dict['CONN_MAX_AGE'] = configuration['conn_max_age']
+        settings_dict['OPTIONS'].pop('transaction_mode', None)
+        if configuration['transaction_mode']:
+            settings_dict['OPTIONS']['transaction_mode'] = configuration['transaction_mode']
+        # The journal mode is stored in the database file and can only change while no other connection is open
+        with connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA journal_mode = {configuration["journal_mode"]}')
+        connections.close_all()
+
+        year = timezone.now().year
+        outcomes = []
+        lock = threading.Lock()
+
+        def write(seed):
+            generator = random.Random(seed)
+            for _ in range(options['operations']):
+                bet_id = generator.choice(bet_ids)
+                timed('write', lambda: submit_bet(bet_id, generator.randint(0, 3), generator.randint(0, 3)))
+            connections.close_all()
+
+        def read(seed):
+            for _ in range(options['operations']):
+                timed('read', lambda: list(
+                    Bet.objects.filter(game__start_time__year=year, counted=True)
+                    .values('user').annotate(points=Sum('points'), bets=Count('id'))
+                ))
+            connections.close_all()
+
+        def timed(kind, operation):
+            started = time.perf_counter()
+            try:
+                operation()
+                outcome = 'ok'
+            except OperationalError as error:
+                outcome = 'locked' if 'locked' in str(error) else 'error'
+            finally:
+                close_old_connections()
+            with lock:
+                outcomes.append((kind, (time.perf_counter() - started) * 1000, outcome))
+
+        with override_settings(SQLITE_PRAGMAS=configuration['pragmas']):
+            started = time.perf_counter()
+            with ThreadPoolExecutor(options['writers'] + options['readers']) as executor:
+                futures = [executor.submit(write, seed) for seed in range(options['writers'])]
+                futures += [executor.submit(read, seed) for seed in range(options['readers'])]
+                for future in futures:
+                    future.result()
+            seconds = time.perf_counter() - started
+
+        return {
+            'seconds': round(seconds, 3),
+            'operations_per_second': round(len(outcomes) / seconds),
+            **{
+                kind: {
+                    'operations': sum(outcome[0] == kind for outcome in outcomes),
+                    'lock_errors': sum(outcome[0] == kind and outcome[2] == 'locked' for outcome in outcomes),
+                    'errors': sum(outcome[0] == kind and outcome[2] == 'error' for outcome in outcomes),
+                    **percentiles([latency for outcome_kind, latency, outcome in outcomes if outcome_kind == kind and outcome == 'ok']),
+                }
+                for kind in ('write', 'read')
+            },
+        }
+
+
+def submit_bet(bet_id, home_goals, away_goals):
+    ''' Reads and changes a bet in one transaction, like the bet form does '''
+    with transaction.atomic():
+        bet = Bet.objects.get(pk=bet_id)
+        Bet.objects.filter(pk=bet.pk).update(home_goals=home_goals, away_goals=away_goals, updated=timezone.now())
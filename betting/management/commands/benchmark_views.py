@@ -0,0 +1,98 @@
+import json
+import statistics
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ._harness import logged_in_client, measure, routes, seed, test_database
+
+# Most queries a page may make on a cold cache, whatever the size of the dataset
+QUERY_BUDGETS = {
+    'login': 2,
+    'index': 30,
+    'list-team': 5,
+    'create-team': 5,
+    'update-team': 5,
+    'create-game': 10,
+    'update-game': 10,
+    'detail': 30,
+    'list-standings': 30,
+    'statistics': 10,
+    'calendar': 5,
+    'deadline-calendar': 10,
+    'list-standing-prediction': 20,
+    'table-bet': 30,
+    'table-bet-summary': 20,
+    'competition-overview': 30,
+    'chart-data-view': 10,
+    'world-cup-bet': 10,
+    'cache-stats': 5,
+}
+# Extra reads a page may make on the largest dataset compared with the smallest one, writes are batched so they may grow
+QUERY_GROWTH = 0
+
+
+class Command(BaseCommand):
+    help = 'Measures query count, SQL time, wall time and response size of every betting page on datasets of increasing size'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10, 50, 200], help='Number of users of each dataset')
+        parser.add_argument('--seasons', type=int, default=2)
+        parser.add_argument('--games', type=int, default=30)
+        parser.add_argument('--repeat', type=int, default=5, help='Number of requests per page, the first one on a cold cache')
+        parser.add_argument('--output', help='Write the JSON report to this file instead of standard output')
+        parser.add_argument('--no-budgets', action='store_true', help='Report only, without failing on budget violations')
+
+    def handle(self, *args, **options):
+        report = {'sizes': {}}
+        with test_database():
+            for size in sorted(options['sizes']):
+                user = seed(size, seasons=options['seasons'], games=options['games'])
+                client = logged_in_client(user)
+                results = {}
+                for name, url in routes(user):
+                    runs = [measure(client, url) for _ in range(max(options['repeat'], 1))]
+                    cold, warm = runs[0], runs[1:] or runs
+                    results[name] = {
+                        'url': url,
+                        'status': cold['status'],
+                        'bytes': cold['bytes'],
+                        'cold': {key: cold[key] for key in ('queries', 'selects', 'sql_ms', 'wall_ms')},
+                        'warm': {
+                            'queries': max(run['queries'] for run in warm),
+                            'selects': max(run['selects'] for run in warm),
+                            'sql_ms': round(statistics.median(run['sql_ms'] for run in warm), 3),
+                            'wall_ms': round(statistics.median(run['wall_ms'] for run in warm), 3),
+                        },
+                    }
+                report['sizes'][str(size)] = results
+                self.stderr.write(f'Measured {len(results)} pages with {size} users')
+
+        report['violations'] = [] if options['no_budgets'] else budget_violations(report['sizes'])
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output)
+        else:
+            self.stdout.write(output)
+
+        if report['violations']:
+            raise CommandError('Budgets exceeded:\n' + '\n'.join(report['violations']))
+
+
+def budget_violations(sizes):
+    ''' Returns a description of every page that failed, made too many queries or made more reads on larger datasets '''
+    violations = []
+    smallest, largest = sizes[min(sizes, key=int)], sizes[max(sizes, key=int)]
+    for size, results in sizes.items():
+        for name, result in results.items():
+            if result['status'] >= 400:
+                violations.append(f'{name} returned {result["status"]} with {size} users')
+            budget = QUERY_BUDGETS.get(name)
+            if budget is not None and result['cold']['queries'] > budget:
+                violations.append(f'{name} made {result["cold"]["queries"]} queries with {size} users, the budget is {budget}')
+    for name, result in largest.items():
+        for run in ('cold', 'warm'):
+            growth = result[run]['selects'] - smallest[name][run]['selects']
+            if growth > QUERY_GROWTH:
+                violations.append(f'{name} made {growth} more reads ({run}) with {max(sizes, key=int)} users than with {min(sizes, key=int)}')
+    return violations
@@ -0,0 +1,162 @@
+import json
+import os
+import random
+import tempfile
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, close_old_connections
+from django.urls import reverse
+from django.utils import timezone
+
+from betting.models import Competition, Game
+
+from ._harness import logged_in_client, percentiles, seed, test_database
+
+PHASES = ['bets', 'final-whistle']
+
+
+class Clock:
+    ''' Simulated time, replacing timezone.now for every thread while a season is replayed '''
+
+    def __init__(self, now):
+        self.current = now
+
+    def now(self):
+        return self.current
+
+    def set(self, now):
+        self.current = now
+
+
+class Command(BaseCommand):
+    help = 'Replays match days of a seeded season with concurrent bets, result entries and page views, reporting latency per phase'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--games', type=int, default=30, help='Number of league games of the seeded season')
+        parser.add_argument('--match-days', type=int, default=10, help='Number of games to replay, 0 for all of them')
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--bet-rate', type=float, default=0.9, help='Share of users betting in the last minutes before their deadline')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Write the JSON report to this file instead of standard output')
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        results = defaultdict(list)
+        with tempfile.TemporaryDirectory() as directory, test_database(os.path.join(directory, 'replay.sqlite3')):
+            staff = seed(options['users'], seasons=1, games=options['games'], seed=options['seed'])
+            users = list(get_user_model().objects.order_by('pk'))
+            competition = Competition.objects.filter(season=str(timezone.now().year), excluded=False).order_by('pk').first()
+            games = list(Game.objects.filter(competition=competition).select_related('competition').order_by('start_time'))
+            if options['match_days']:
+                games = games[:options['match_days']]
+
+            clock = Clock(games[0].start_time)
+            with mock.patch('django.utils.timezone.now', clock.now), ThreadPoolExecutor(options['threads']) as executor:
+                for game in games:
+                    clock.set(game.start_time - timezone.timedelta(days=1))
+                    # Sessions expire relative to the simulated time, so every match day logs in again
+                    clients = {user: logged_in_client(user, raise_request_exception=True) for user in users}
+                    self.match_day(executor, clock, game, clients, staff, options['bet_rate'], results)
+                    self.stderr.write(f'Replayed {game}')
+
+        report = {
+            'users': options['users'],
+            'threads': options['threads'],
+            'match_days': len(games),
+            'phases': {phase: summarize(*phase_outcomes(results[phase])) for phase in PHASES},
+            'requests': {kind: summarize(outcomes) for kind, outcomes in sorted(outcomes_by_kind(results).items())},
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output)
+        else:
+            self.stdout.write(output)
+
+    def match_day(self, executor, clock, game, clients, staff, bet_rate, results):
+        ''' Submits bets in the last minutes before the deadlines, then enters the result while everyone refreshes the pages '''
+        deadlines = game.get_deadlines()
+        clock.set(min(deadlines.values(), default=game.start_time) - timezone.timedelta(minutes=5))
+        detail_url = reverse('betting:detail', args=[game.pk])
+        tasks = [
+            ('bet', lambda client=client, bet={'home_goals': self.random.randint(0, 3), 'away_goals': self.random.randint(0, 3)}: client.post(detail_url, bet))
+            for client in clients.values()
+            if self.random.random() < bet_rate
+        ]
+        results['bets'].append(run_phase(executor, tasks))
+
+        clock.set(game.start_time + timezone.timedelta(hours=2))
+        result = {
+            'competition': game.competition_id,
+            'home_team': game.home_team_id,
+            'away_team': game.away_team_id,
+            'start_time': timezone.localtime(game.start_time).strftime('%Y-%m-%dT%H:%M'),
+            'home_goals': self.random.randint(0, 4),
+            'away_goals': self.random.randint(0, 3),
+        }
+        update_url = reverse('betting:update-game', args=[game.pk])
+        overview_url = reverse('betting:competition-overview', args=[game.competition_id])
+        tasks = [('result', lambda: clients[staff].post(update_url, result))]
+        for client in clients.values():
+            tasks += [
+                ('detail', lambda client=client: client.get(detail_url)),
+                ('competition-overview', lambda client=client: client.get(overview_url)),
+            ]
+        results['final-whistle'].append(run_phase(executor, tasks))
+
+
+def run_phase(executor, tasks):
+    ''' Runs the requests on the thread pool and returns their outcomes and the duration of the whole phase '''
+    started = time.perf_counter()
+    outcomes = list(executor.map(lambda task: timed_request(*task), tasks))
+    return outcomes, time.perf_counter() - started
+
+
+def timed_request(kind, request):
+    ''' Returns the kind, latency in milliseconds and outcome of a request: ok, error or locked
+
+    Like at the end of a real request, the database connection of the thread is closed unless CONN_MAX_AGE keeps it.
+    '''
+    started = time.perf_counter()
+    try:
+        outcome = 'ok' if request().status_code < 400 else 'error'
+    except OperationalError as error:
+        outcome = 'locked' if 'locked' in str(error) else 'error'
+    except Exception:
+        outcome = 'error'
+    finally:
+        close_old_connections()
+    return kind, (time.perf_counter() - started) * 1000, outcome
+
+
+def phase_outcomes(phase_results):
+    ''' Returns the outcomes of all runs of a phase and their total duration '''
+    return [outcome for outcomes, _ in phase_results for outcome in outcomes], sum(seconds for _, seconds in phase_results)
+
+
+def outcomes_by_kind(results):
+    by_kind = defaultdict(list)
+    for phase_results in results.values():
+        for outcome in phase_outcomes(phase_results)[0]:
+            by_kind[outcome[0]].append(outcome)
+    return by_kind
+
+
+def summarize(outcomes, seconds=None):
+    ''' Returns the request count, errors, lock errors, latency percentiles and, given the duration, throughput of requests '''
+    summary = {
+        'requests': len(outcomes),
+        'errors': sum(outcome == 'error' for _, _, outcome in outcomes),
+        'lock_errors': sum(outcome == 'locked' for _, _, outcome in outcomes),
+        **percentiles([latency for _, latency, _ in outcomes]),
+    }
+    if seconds:
+        summary['seconds'] = round(seconds, 3)
+        summary['throughput'] = round(len(outcomes) / seconds, 1)
+    return summary
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from betting.scoring import rescore_season
+
+
+class Command(BaseCommand):
+    help = 'Recalculates the points of all bets placed during the given years'
+
+    def add_arguments(self, parser):
+        parser.add_argument('years', nargs='+', type=int)
+
+    def handle(self, *args, **options):
+        for year in options['years']:
+            changed = rescore_season(year)
+            self.stdout.write(self.style.SUCCESS(f'{year}: updated points for {changed} bet(s)'))
@@ -0,0 +1,154 @@
+import random
+import time
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from betting.leaderboard import invalidate_leaderboards
+from betting.models import Team, Competition, Game, Bet, StandingPrediction, StandingPredictionTeam, Standing, TeamPosition
+from betting.scoring import rebuild_season_scores
+from betting.standings import COMPETITIONS
+
+TEAM_NAMES = [
+    'Malmö FF', 'AIK', 'Djurgårdens IF', 'Hammarby IF', 'IFK Göteborg', 'IF Elfsborg', 'BK Häcken', 'IFK Norrköping',
+    'Mjällby AIF', 'IK Sirius', 'Halmstads BK', 'IF Brommapojkarna', 'GAIS', 'IFK Värnamo', 'Degerfors IF', 'Östers IF',
+]
+PLAYER_NAMES = ['Isaac Kiese Thelin', 'Mikkel Rygaard Jensen', 'Hugo Bolin', 'Sead Haksabanovic', 'Erik Botheim', 'Anders Christiansen']
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = 'Creates synthetic users, seasons, games, bets and standings for local performance measurements'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--seasons', type=int, default=2, help='Number of seasons, ending with the current year')
+        parser.add_argument('--games', type=int, default=30, help='Number of league games per season')
+        parser.add_argument('--cup-games', type=int, default=3, help='Number of games per season in an excluded cup competition')
+        parser.add_argument('--bet-rate', type=float, default=0.9, help='Share of games each user bets on')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--prefix', default='seed', help='Prefix of the usernames of the generated users')
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        if User.objects.filter(username__startswith=f'{options["prefix"]}-').exists():
+            raise CommandError(f'Users with the prefix "{options["prefix"]}" already exist, choose another --prefix')
+
+        started = time.perf_counter()
+        self.random = random.Random(options['seed'])
+        self.now = timezone.now()
+        years = range(self.now.year - options['seasons'] + 1, self.now.year + 1)
+
+        with transaction.atomic():
+            teams = self.create_teams()
+            password = make_password(options['prefix'])
+            users = User.objects.bulk_create([
+                User(username=f'{options["prefix"]}-{i}', first_name=f'{options["prefix"].capitalize()} {i}', password=password)
+                for i in range(1, options['users'] + 1)
+            ], batch_size=BATCH_SIZE)
+
+            bets = 0
+            for year in years:
+                league = self.create_competition('Allsvenskan', year, teams, COMPETITIONS.get(str(year)))
+                cup = self.create_competition('Svenska Cupen', year, teams, excluded=True)
+                games = self.create_games(league, teams, year, options['games'], month=4)
+                self.create_standings(league, teams, sum(game.has_started() for game in games))
+                games += self.create_games(cup, teams, year, options['cup_games'], month=2)
+                bets += self.create_bets(games, users, options['bet_rate'])
+                self.create_predictions(league, teams, users)
+
+        for year in years:
+            rebuild_season_scores(year)
+            invalidate_leaderboards(year)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {len(users)} users, {len(years)} seasons and {bets} bets in {time.perf_counter() - started:.1f} s'
+        ))
+
+    def create_teams(self):
+        ''' Returns the teams of the seasons, with Malmö FF as team 1 since all bets are seen from Malmö FF '''
+        if not Team.objects.filter(pk=1).exists():
+            Team.objects.create(pk=1, name=TEAM_NAMES[0])
+        existing = {team.name for team in Team.objects.filter(name__in=TEAM_NAMES[1:])}
+        Team.objects.bulk_create([Team(name=name) for name in TEAM_NAMES[1:] if name not in existing])
+        teams = {team.name: team for team in Team.objects.filter(name__in=TEAM_NAMES[1:]).order_by('pk')}
+        return [Team.objects.get(pk=1)] + [teams[name] for name in TEAM_NAMES[1:]]
+
+    def create_competition(self, name, year, teams, pk=None, excluded=False):
+        if pk is not None and Competition.objects.filter(pk=pk).exists():
+            pk = None
+        competition = Competition.objects.create(pk=pk, name=name, season=str(year), excluded=excluded)
+        competition.teams.add(*teams)
+        return competition
+
+    def create_games(self, competition, teams, year, number_of_games, month):
+        ''' Creates one Malmö FF game per week, with a result for every game that has started '''
+        first_start_time = timezone.make_aware(timezone.datetime(year, month, 1, 15))
+        games = []
+        for i in range(number_of_games):
+            opponent = teams[1 + i % (len(teams) - 1)]
+            home_team, away_team = (teams[0], opponent) if i % 2 == 0 else (opponent, teams[0])
+            start_time = first_start_time + timezone.timedelta(days=7 * i, hours=self.random.choice([0, 2, 4]))
+            game = Game(competition=competition, home_team=home_team, away_team=away_team, start_time=start_time)
+            if game.has_started():
+                game.home_goals = self.random.choice([0, 0, 1, 1, 1, 2, 2, 3, 4])
+                game.away_goals = self.random.choice([0, 0, 1, 1, 1, 2, 2, 3])
+            games.append(game)
+        return Game.objects.bulk_create(games, batch_size=BATCH_SIZE)
+
+    def create_bets(self, games, users, bet_rate):
+        ''' Creates bets with their points and season total flag calculated in memory '''
+        bets = []
+        for game in games:
+            counted = game.has_started() and not game.competition.excluded
+            for user in users:
+                if self.random.random() > bet_rate:
+                    continue
+                bet = Bet(
+                    game=game,
+                    user=user,
+                    home_goals=self.random.choice([0, 1, 1, 2, 2, 3]),
+                    away_goals=self.random.choice([0, 1, 1, 2]),
+                    updated=game.start_time - timezone.timedelta(minutes=self.random.randint(10, 60 * 24 * 3)),
+                    counted=counted,
+                )
+                bet.points = bet.calculate_points()
+                bets.append(bet)
+        Bet.objects.bulk_create(bets, batch_size=BATCH_SIZE)
+        return len(bets)
+
+    def create_standings(self, competition, teams, rounds):
+        ''' Creates a standing with a shuffled table for every played round, and one for round 1 before the season '''
+        standings = Standing.objects.bulk_create([
+            Standing(
+                competition=competition,
+                round=round,
+                top_scorer=self.random.choice(PLAYER_NAMES),
+                most_assists=self.random.choice(PLAYER_NAMES),
+            )
+            for round in range(1, max(rounds, 1) + 1)
+        ])
+        team_positions = []
+        for standing in standings:
+            for position, team in enumerate(self.random.sample(teams, len(teams)), 1):
+                team_positions.append(TeamPosition(standing=standing, team=team, position=position))
+        TeamPosition.objects.bulk_create(team_positions, batch_size=BATCH_SIZE)
+
+    def create_predictions(self, competition, teams, users):
+        predictions = StandingPrediction.objects.bulk_create([
+            StandingPrediction(
+                user=user,
+                competition=competition,
+                top_scorer=', '.join(self.random.sample(PLAYER_NAMES, 2)),
+                most_assists=', '.join(self.random.sample(PLAYER_NAMES, 2)),
+            )
+            for user in users
+        ], batch_size=BATCH_SIZE)
+        prediction_teams = []
+        for prediction in predictions:
+            for position, team in enumerate(self.random.sample(teams, len(teams)), 1):
+                prediction_teams.append(StandingPredictionTeam(standing_prediction=prediction, team=team, position=position))
+        StandingPredictionTeam.objects.bulk_create(prediction_teams, batch_size=BATCH_SIZE)
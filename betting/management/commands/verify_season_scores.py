@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from betting.models import UserSeasonScore
+from betting.scoring import SEASON_SCORE_FIELDS, compute_season_scores, rebuild_season_scores
+
+
+class Command(BaseCommand):
+    help = 'Compares the stored season totals of the given years with totals recomputed from the bets'
+
+    def add_arguments(self, parser):
+        parser.add_argument('years', nargs='+', type=int)
+        parser.add_argument('--fix', action='store_true', help='Replace the stored totals with the recomputed ones')
+
+    def handle(self, *args, **options):
+        for year in options['years']:
+            computed = compute_season_scores(year)
+            stored = {
+                season_score.user_id: {field: getattr(season_score, field) for field in SEASON_SCORE_FIELDS}
+                for season_score in UserSeasonScore.objects.filter(year=year)
+            }
+            empty = dict.fromkeys(SEASON_SCORE_FIELDS, 0)
+            drift = [
+                (user_id, stored.get(user_id, empty), computed.get(user_id, empty))
+                for user_id in sorted(stored.keys() | computed.keys())
+                if stored.get(user_id, empty) != computed.get(user_id, empty)
+            ]
+
+            for user_id, stored_totals, computed_totals in drift:
+                self.stdout.write(f'{year}: user {user_id} has {stored_totals}, expected {computed_totals}')
+
+            if not drift:
+                self.stdout.write(self.style.SUCCESS(f'{year}: season totals of {len(computed)} user(s) are correct'))
+            elif options['fix']:
+                rebuild_season_scores(year)
+                self.stdout.write(self.style.SUCCESS(f'{year}: rebuilt season totals of {len(computed)} user(s)'))
+            else:
+                self.stdout.write(self.style.ERROR(f'{year}: season totals of {len(drift)} user(s) have drifted'))
@@ -0,0 +1,220 @@
+''' Counters and histograms of the betting hot paths in the Prometheus text format
+
+Every worker process keeps its metrics in memory and writes them to its own JSON file in METRICS_DIR at most
+once per FLUSH_INTERVAL, so the metrics endpoint can add up the files of all workers.
+'''
+import atexit
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager, suppress
+
+from django.conf import settings
+
+FLUSH_INTERVAL = 1
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+REGISTRY = {}
+_lock = threading.Lock()
+# One thread per process writes the file at a time
+_flush_lock = threading.Lock()
+_last_flush = {'time': 0.0}
+
+logger = logging.getLogger(__name__)
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        REGISTRY[name] = self
+
+    def key(self, labels):
+        ''' Returns the labels in the order of the label names, as a JSON string usable as a dictionary key in the files '''
+        return json.dumps([str(labels[name]) for name in self.labelnames])
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with _lock:
+            state = self.values.setdefault(key, {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0})
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state['buckets'][i] += 1
+                    break
+            state['sum'] += value
+            state['count'] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+
+LEADERBOARD_SECONDS = Histogram('betting_get_leaderboard_seconds', 'Duration of Game.get_leaderboard calls, cached or computed')
+DEADLINES_SECONDS = Histogram('betting_get_deadlines_seconds', 'Duration of Game.get_deadlines calls, cached or computed')
+BET_SUBMISSIONS = Counter('betting_bet_submissions_total', 'Bets submitted by users, by result', ['result'])
+RESCORE_SECONDS = Histogram('betting_rescore_seconds', 'Duration of rescoring the bets of a saved game')
+CACHE_LOOKUPS = Counter('betting_cache_lookups_total', 'Lookups of cached betting data, by where they were found', ['result'])
+REQUEST_SECONDS = Histogram('betting_request_seconds', 'Duration of requests, by view', ['view'])
+REQUEST_QUERIES = Histogram('betting_request_queries', 'Database queries of requests, by view', ['view'], buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500))
+
+
+def snapshot():
+    with _lock:
+        return {name: json.loads(json.dumps(metric.values)) for name, metric in REGISTRY.items()}
+
+
+def process_file(pid):
+    return os.path.join(settings.METRICS_DIR, f'metrics-{pid}.json')
+
+
+def flush():
+    ''' Writes the metrics of this process to its file, replacing the previous one in a single step '''
+    with _flush_lock:
+        write_process_file()
+
+
+def maybe_flush():
+    ''' Writes the file if the last write is older than FLUSH_INTERVAL, unless another thread is writing it '''
+    if time.time() - _last_flush['time'] < FLUSH_INTERVAL or not _flush_lock.acquire(blocking=False):
+        return
+    try:
+        if time.time() - _last_flush['time'] >= FLUSH_INTERVAL:
+            write_process_file()
+    finally:
+        _flush_lock.release()
+
+
+def write_process_file():
+    ''' Moves a temporary file of its own over the file of the process, logging errors so they never fail a request '''
+    _last_flush['time'] = time.time()
+    try:
+        os.makedirs(settings.METRICS_DIR, mode=0o700, exist_ok=True)
+        descriptor, temporary_path = tempfile.mkstemp(dir=settings.METRICS_DIR, prefix='.metrics-', suffix='.tmp')
+        try:
+            with os.fdopen(descriptor, 'w') as file:
+                json.dump(snapshot(), file)
+            os.replace(temporary_path, process_file(os.getpid()))
+        except BaseException:
+            with suppress(OSError):
+                os.remove(temporary_path)
+            raise
+    except OSError:
+        logger.exception('Could not write the metrics of process %s', os.getpid())
+
+
+atexit.register(flush)
+
+
+def process_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def collect():
+    ''' Returns the metrics of all running workers added up, reading this process from memory and the others from their files
+
+    Files of workers that are gone are removed, which Prometheus sees as a counter reset.
+    '''
+    merged = {}
+    sources = [snapshot()]
+    if os.path.isdir(settings.METRICS_DIR):
+        for filename in os.listdir(settings.METRICS_DIR):
+            if not (filename.startswith('metrics-') and filename.endswith('.json')):
+                continue
+            pid = int(filename[len('metrics-'):-len('.json')])
+            if pid == os.getpid():
+                continue
+            if not process_running(pid):
+                os.remove(os.path.join(settings.METRICS_DIR, filename))
+                continue
+            try:
+                with open(os.path.join(settings.METRICS_DIR, filename)) as file:
+                    sources.append(json.load(file))
+            except (OSError, ValueError):
+                continue
+
+    for source in sources:
+        for name, values in source.items():
+            metric = REGISTRY.get(name)
+            if metric is None:
+                continue
+            totals = merged.setdefault(name, {})
+            for key, value in values.items():
+                if metric.type == 'counter':
+                    totals[key] = totals.get(key, 0) + value
+                else:
+                    total = totals.setdefault(key, {'buckets': [0] * len(metric.buckets), 'sum': 0.0, 'count': 0})
+                    total['buckets'] = [a + b for a, b in zip(total['buckets'], value['buckets'])]
+                    total['sum'] += value['sum']
+                    total['count'] += value['count']
+    return merged
+
+
+def format_labels(metric, key, **extra):
+    pairs = list(zip(metric.labelnames, json.loads(key))) + list(extra.items())
+    if not pairs:
+        return ''
+    escaped = (f'{name}="{escape(value)}"' for name, value in pairs)
+    return '{' + ','.join(escaped) + '}'
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def render():
+    ''' Returns the metrics of all workers in the Prometheus text exposition format '''
+    merged = collect()
+    lines = []
+    for name, metric in REGISTRY.items():
+        lines.append(f'# HELP {name} {metric.documentation}')
+        lines.append(f'# TYPE {name} {metric.type}')
+        for key, value in sorted(merged.get(name, {}).items()):
+            if metric.type == 'counter':
+                lines.append(f'{name}{format_labels(metric, key)} {format_value(value)}')
+                continue
+            cumulative = 0
+            for bound, count in zip(metric.buckets, value['buckets']):
+                cumulative += count
+                lines.append(f'{name}_bucket{format_labels(metric, key, le=format_value(bound))} {cumulative}')
+            lines.append(f'{name}_bucket{format_labels(metric, key, le="+Inf")} {value["count"]}')
+            lines.append(f'{name}_sum{format_labels(metric, key)} {format_value(value["sum"])}')
+            lines.append(f'{name}_count{format_labels(metric, key)} {value["count"]}')
+    return '\n'.join(lines) + '\n'
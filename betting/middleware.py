@@ -0,0 +1,283 @@
+import json
+import logging
+import random
+import re
+import threading
+import time
+import traceback
+import tracemalloc
+from collections import deque
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.template.backends.django import DjangoTemplates, Template, reraise
+from django.template.exceptions import TemplateDoesNotExist
+
+from . import metrics, profiler
+
+logger = logging.getLogger('betting.timing')
+allocation_logger = logging.getLogger('betting.allocations')
+
+_local = threading.local()
+# The recent slow queries of this process, oldest first
+slow_queries = deque(maxlen=settings.SLOW_QUERY_BUFFER_SIZE)
+# The recent allocation profiles of this process, oldest first
+allocation_profiles = deque(maxlen=50)
+# tracemalloc is global to the process, so one request at a time is profiled
+_allocation_lock = threading.Lock()
+
+
+class QueryTimer:
+    ''' Database execute wrapper counting the queries, the reads among them and their time '''
+
+    def __init__(self):
+        self.queries = 0
+        self.selects = 0
+        self.time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.time += time.perf_counter() - started
+            self.queries += 1
+            self.selects += sql.lstrip().upper().startswith('SELECT')
+
+
+class TimedTemplate(Template):
+    ''' Template adding its render time to the timings of the current request, if it is sampled '''
+
+    def render(self, context=None, request=None):
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            timings = getattr(_local, 'timings', None)
+            if timings is not None:
+                timings['template'] += time.perf_counter() - started
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    ''' The Django template backend, with timed templates '''
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return TimedTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
+
+
+class ServerTimingMiddleware:
+    ''' Measures queries, database, template, view and total time of a sample of the requests
+
+    The timings are sent in a Server-Timing header and logged as one JSON object per request.
+    '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if random.random() >= settings.REQUEST_TIMING_SAMPLE_RATE:
+            return self.get_response(request)
+
+        started = time.perf_counter()
+        query_timer = QueryTimer()
+        _local.timings = {'template': 0.0, 'view_started': None}
+        try:
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(query_timer))
+                response = self.get_response(request)
+            timings = _local.timings
+        finally:
+            _local.timings = None
+        finished = time.perf_counter()
+
+        measurements = {
+            'db': query_timer.time * 1000,
+            'tpl': timings['template'] * 1000,
+            'view': (finished - timings['view_started']) * 1000 if timings['view_started'] else 0.0,
+            'total': (finished - started) * 1000,
+        }
+        response['Server-Timing'] = ', '.join(
+            f'{name};dur={duration:.1f}' + (f';desc="{query_timer.queries} queries"' if name == 'db' else '')
+            for name, duration in measurements.items()
+        )
+        logger.info(json.dumps({
+            'time': round(time.time(), 3),
+            'method': request.method,
+            'path': request.path,
+            'view': request.resolver_match.view_name if request.resolver_match else None,
+            'status': response.status_code,
+            'queries': query_timer.queries,
+            **{f'{name}_ms': round(duration, 3) for name, duration in measurements.items()},
+        }))
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        timings = getattr(_local, 'timings', None)
+        if timings is not None:
+            timings['view_started'] = time.perf_counter()
+
+
+class SlowQueryRecorder:
+    ''' Database execute wrapper keeping the queries slower than SLOW_QUERY_THRESHOLD_MS in the slow query buffer '''
+
+    def __init__(self, request):
+        self.request = request
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = (time.perf_counter() - started) * 1000
+            if duration >= settings.SLOW_QUERY_THRESHOLD_MS:
+                slow_queries.append({
+                    'time': time.time(),
+                    'sql': sql,
+                    'params': repr(params)[:500],
+                    'duration_ms': round(duration, 3),
+                    'view': self.request.resolver_match.view_name if self.request.resolver_match else self.request.path,
+                    'stack': project_stack(),
+                })
+
+
+def project_stack(limit=8):
+    ''' Returns the innermost frames of the current stack that are in the project, outside of Django and this module '''
+    project = str(settings.BASE_DIR)
+    frames = [
+        f'{frame.filename[len(project) + 1:]}:{frame.lineno} in {frame.name}'
+        for frame in traceback.extract_stack()
+        if frame.filename.startswith(project) and 'site-packages' not in frame.filename and frame.filename != __file__
+    ]
+    return frames[-limit:]
+
+
+def normalize_sql(sql):
+    ''' Returns the shape of a query, with literals and lists of parameters replaced by placeholders '''
+    sql = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    sql = re.sub(r'\b\d+(?:\.\d+)?\b', '?', sql)
+    sql = re.sub(r'%s|\?', '?', sql)
+    sql = re.sub(r'\(\s*\?(?:\s*,\s*\?)*\s*\)', '(...)', sql)
+    return re.sub(r'\s+', ' ', sql).strip()
+
+
+def slow_query_summary():
+    ''' Returns the buffered slow queries grouped by shape, the slowest total first '''
+    shapes = {}
+    for query in list(slow_queries):
+        shape = shapes.setdefault(normalize_sql(query['sql']), {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'views': set()})
+        shape['count'] += 1
+        shape['total_ms'] += query['duration_ms']
+        shape['max_ms'] = max(shape['max_ms'], query['duration_ms'])
+        shape['views'].add(query['view'])
+    return sorted(
+        ({'sql': sql, **shape, 'total_ms': round(shape['total_ms'], 3), 'views': sorted(shape['views'])} for sql, shape in shapes.items()),
+        key=lambda shape: -shape['total_ms']
+    )
+
+
+class SlowQueryMiddleware:
+    ''' Keeps the slow queries of every request in the slow query buffer '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = SlowQueryRecorder(request)
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(recorder))
+            return self.get_response(request)
+
+
+class AllocationProfilingMiddleware:
+    ''' Traces the memory allocations of a sample of the views named in ALLOCATION_PROFILING_URL_NAMES
+
+    The peak allocation and the top allocating lines are logged and kept for the slow query page.
+    '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if getattr(request, '_allocation_profiling', False):
+            self.finish(request, response)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        url_name = request.resolver_match.view_name
+        if url_name not in settings.ALLOCATION_PROFILING_URL_NAMES or random.random() >= settings.ALLOCATION_PROFILING_SAMPLE_RATE:
+            return
+        if tracemalloc.is_tracing() or not _allocation_lock.acquire(blocking=False):
+            return
+        request._allocation_profiling = True
+        tracemalloc.start()
+
+    def finish(self, request, response):
+        try:
+            snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+            _allocation_lock.release()
+
+        profile = {
+            'time': round(time.time(), 3),
+            'path': request.path,
+            'view': request.resolver_match.view_name,
+            'status': response.status_code,
+            'peak_kb': round(peak / 1024, 1),
+            'retained_kb': round(current / 1024, 1),
+            'top_lines': [
+                {'line': str(statistic.traceback[0]), 'size_kb': round(statistic.size / 1024, 1), 'count': statistic.count}
+                for statistic in snapshot.statistics('lineno')[:settings.ALLOCATION_PROFILING_TOP_LINES]
+            ],
+        }
+        allocation_profiles.append(profile)
+        allocation_logger.info(json.dumps(profile))
+
+
+class SamplingProfilerMiddleware:
+    ''' Samples the stacks of the requests to the view the profiler is switched on for, see betting.profiler '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        sampler = getattr(request, '_stack_sampler', None)
+        if sampler is not None:
+            profiler.finish_sampler(sampler)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if profiler.should_profile(request.resolver_match.view_name):
+            request._stack_sampler = profiler.start_sampler()
+
+
+class MetricsMiddleware:
+    ''' Observes the duration and query count of every request per view, see betting.metrics '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        query_timer = QueryTimer()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(query_timer))
+            response = self.get_response(request)
+        view = request.resolver_match.view_name if request.resolver_match else 'unresolved'
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - started, view=view)
+        metrics.REQUEST_QUERIES.observe(query_timer.queries, view=view)
+        metrics.maybe_flush()
+        return response
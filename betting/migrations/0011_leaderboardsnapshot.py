@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:29
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('betting', '0010_standing_clean_sheets_standing_most_points_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeaderboardSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('game_points', models.IntegerField(default=0)),
+                ('goal_difference', models.IntegerField(default=0)),
+                ('goals_scored', models.IntegerField(default=0)),
+                ('table_points', models.IntegerField(default=0)),
+                ('extra_bet', models.IntegerField(default=0)),
+                ('total_score', models.IntegerField(default=0)),
+                ('position', models.PositiveSmallIntegerField()),
+                ('game', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='leaderboard_snapshots', to='betting.game')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('game', 'user'), name='one_snapshot_per_user_per_game')],
+            },
+        ),
+    ]
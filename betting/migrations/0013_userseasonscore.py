@@ -0,0 +1,69 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:47
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Case, Count, F, IntegerField, Sum, When
+from django.db.models.functions import ExtractYear
+from django.utils import timezone
+
+
+def populate_season_scores(apps, schema_editor):
+    Bet = apps.get_model('betting', 'Bet')
+    UserSeasonScore = apps.get_model('betting', 'UserSeasonScore')
+    Bet.objects.filter(game__start_time__lte=timezone.now(), game__competition__excluded=False).update(counted=True)
+    totals = (
+        Bet.objects.filter(counted=True)
+        .values('user', year=ExtractYear('game__start_time'))
+        .annotate(
+            points=Sum('points'),
+            goal_diff=Sum(Case(
+                When(game__home_team__id=1, then=(F('home_goals') - F('away_goals')) - (F('game__home_goals') - F('game__away_goals'))),
+                default=(F('away_goals') - F('home_goals')) - (F('game__away_goals') - F('game__home_goals')),
+                output_field=IntegerField()
+            )),
+            goals_scored_diff=Sum(Case(
+                When(game__home_team__id=1, then=F('home_goals') - F('game__home_goals')),
+                default=F('away_goals') - F('game__away_goals'),
+                output_field=IntegerField()
+            )),
+            bets_count=Count('id'),
+        )
+        .order_by()
+    )
+    UserSeasonScore.objects.bulk_create([
+        UserSeasonScore(user_id=row.pop('user'), **row)
+        for row in totals
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('betting', '0012_betdeadline'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bet',
+            name='counted',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.CreateModel(
+            name='UserSeasonScore',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveSmallIntegerField()),
+                ('points', models.IntegerField(default=0)),
+                ('goal_diff', models.IntegerField(default=0)),
+                ('goals_scored_diff', models.IntegerField(default=0)),
+                ('bets_count', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='season_scores', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('year', 'user'), name='one_score_per_user_per_year')],
+            },
+        ),
+        migrations.RunPython(populate_season_scores, migrations.RunPython.noop),
+    ]
@@ -1,16 +1,14 @@
 from django.utils import timezone
 from django.core.exceptions import ValidationError
 from django.conf import settings
-from django.contrib.auth import get_user_model
 from django.db import models
-from django.db.models.signals import post_save
-from django.dispatch import receiver
-from django.db.models import Case, When, Sum, Window, F, IntegerField, ExpressionWrapper, Min
-from django.db.models.functions import Rank, Abs
+from django.db.models import Case, When
 from django.urls import reverse
 
 import math
 
+from . import metrics
+
 # Create your models here.
 class Team(models.Model):
     ''' A team with related details '''
@@ -37,6 +35,17 @@ class Competition(models.Model):
         return f'{self.name} {self.season}'
 
 
+class GameQuerySet(models.QuerySet):
+    def with_deadlines(self, user):
+        ''' Returns the games as a list with the deadline of the user attached as user_deadline '''
+        from .leaderboard import get_deadlines_for_games
+        games = list(self)
+        deadlines = get_deadlines_for_games(games) if user.is_authenticated else None
+        for game in games:
+            game.user_deadline = deadlines[game].get(user, game.start_time) if deadlines is not None else None
+        return games
+
+
 class Game(models.Model):
     ''' A game with related details '''
     competition = models.ForeignKey(Competition, on_delete=models.PROTECT, related_name='games')
@@ -47,6 +56,11 @@ class Game(models.Model):
     home_goals = models.PositiveSmallIntegerField(default=0)
     away_goals = models.PositiveSmallIntegerField(default=0)
 
+    objects = GameQuerySet.as_manager()
+
+    # Fields that decide what the bets of the game add to the season totals
+    SCORE_FIELDS = ('home_goals', 'away_goals', 'start_time', 'home_team_id')
+
     class Meta:
         ordering = ['-start_time']
 
@@ -78,173 +92,26 @@ class Game(models.Model):
         else:
             return '2'
 
+    def score_state(self):
+        ''' Returns the values of the score fields of the game '''
+        return tuple(getattr(self, field) for field in self.SCORE_FIELDS)
+
     def get_leaderboard(self):
         """Return the leaderboard at the start of this game."""
-        if self.competition.excluded:
-            leaderboard = (
-                Bet.objects.filter(
-                    game__competition=self.competition,
-                    game__start_time__lt=self.start_time
-                )
-                .values('user')
-                .annotate(
-                    game_points=Sum('points'),
-                    goal_difference=Sum(0),
-                    goals_scored=Sum(F('home_goals') - F('game__home_goals') + F('away_goals') - F('game__away_goals')),
-                    position=Window(
-                        expression=Rank(),
-                        order_by=[
-                            F('game_points').desc(),
-                            Abs(F('goal_difference')).asc(),
-                            Abs(F('goals_scored')).asc()
-                        ]
-                    )
-                )
-            )
-        else:
-            leaderboard = (
-                Bet.objects.filter(
-                    game__start_time__year=self.start_time.year,
-                    game__start_time__lt=self.start_time
-                )
-                .values('user')
-                .annotate(
-                    game_points=Sum('points'),
-                    goal_difference=Sum(
-                        ExpressionWrapper(
-                            Case(
-                                When(game__home_team__id = 1, then=(F('game__away_goals') - F('game__home_goals')) - (F('away_goals') - F('home_goals'))),
-                                default=(F('game__home_goals') - F('game__away_goals')) - (F('home_goals') - F('away_goals'))
-                            ),
-                            output_field=IntegerField()
-                        )
-                    ),
-                    goals_scored=Sum(
-                        ExpressionWrapper(
-                            Case(
-                                When(game__home_team__id = 1, then=F('home_goals') - F('game__home_goals')),
-                                default=F('away_goals') - F('game__away_goals')
-                            ),
-                            output_field=IntegerField()
-                        )
-                    ),
-                    position=Window(
-                        expression=Rank(),
-                        order_by=[
-                            F('game_points').desc(),
-                            Abs(F('goal_difference')).asc(),
-                            Abs(F('goals_scored')).asc()
-                        ]
-                    )
-                )
-            )
-
-        User = get_user_model()
-        users = {user.id: user for user in User.objects.all()}
-
-        competition = Competition.objects.get(name='Allsvenskan', season=self.start_time.year)
-        try:
-            standings = Standing.objects.filter(competition=competition).prefetch_related('team_positions').latest('round')
-        except Standing.DoesNotExist:
-            standings = Standing.objects.create(competition=competition, round=1, top_scorer='N/A', most_assists='N/A')
-            
-        sort_order_list = list(standings.team_positions.values_list('team_id', flat=True).order_by('position'))
-        competition_standings = sorted(competition.teams.all(), key=lambda team: sort_order_list.index(team.id))
-        top_scorer_list = standings.top_scorer
-        most_assists_list = standings.most_assists
-        most_points_list = standings.most_points
-        clean_sheets = standings.clean_sheets
-
-        try:
-            user_standing_predictions = StandingPrediction.objects.select_related('user').prefetch_related('team_positions__team').filter(competition=competition)
-            table_points = {}            
-            for user_standing_prediction in user_standing_predictions:
-                user = user_standing_prediction.user
-                teams = [(standing_prediction_team.position, standing_prediction_team.team) for standing_prediction_team in user_standing_prediction.team_positions.all()]
-                user_top_scorers = user_standing_prediction.top_scorer.split(', ')
-                user_most_assists = user_standing_prediction.most_assists.split(', ')
-                user_most_points = user_standing_prediction.most_points.split(', ')
-                user_clean_sheets = user_standing_prediction.clean_sheets
-                    
-                bet_points = []
-                # for position, team in teams:
-                #     diff = position - competition_standings.index(team) - 1
-                #     bet_points.append(-abs(diff))
-                user_table_points = sum(bet_points)
-
-                extra_bet = 0
-
-                if user_top_scorers == []:
-                    for user_top_scorer in user_top_scorers:
-                        if user_top_scorer in top_scorer_list:
-                            extra_bet += 6
-                if user_most_assists == []:
-                    for user_most_assist in user_most_assists:
-                        if user_most_assist in most_assists_list:
-                            extra_bet += 16
-                # if user_most_points == []:
-                #     for user_most_point in user_most_points:
-                #         if user_most_point in most_points_list:
-                #             extra_bet += 6
-         
-                # extra_bet += -abs(clean_sheets - user_clean_sheets) if user_clean_sheets and clean_sheets else 0
-                
-                table_points[user] = {
-                    'points': user_table_points,
-                    'extra_bet': extra_bet
-                }
-
-        except StandingPrediction.DoesNotExist:
-            user_top_scorer = 'N/A'
-            user_most_assists = 'N/A'
-            user_most_points = 'N/A'
-            user_clean_sheets = 'N/A'
-        if leaderboard.exists():
-            for row in leaderboard:
-                row['user'] = users.get(row['user'])
-                row['table_points'] = table_points.get(row['user'], {}).get('points', 0)
-                row['extra_bet'] = table_points.get(row['user'], {}).get('extra_bet', 0)
-                row['total_score'] = row.get('game_points', 0) + row.get('table_points', 0) + row.get('extra_bet', 0)
-        else:
-            leaderboard = []
-            for user in users.values():
-                row = {
-                    'user': user,
-                    'game_points': 0,
-                    'goal_difference': 0,
-                    'goals_scored': 0,
-                    'table_points': 0,
-                    'extra_bet': 0,
-                    'total_score': 0
-                }
-                leaderboard.append(row)
-
-        leaderboard = sorted(
-            leaderboard,
-            key=lambda x: (
-                -x['total_score'],
-                abs(x['goal_difference']),
-                abs(x['goals_scored'])
-            )
-        )
-
-        # Check if there are ties in the leaderboard and assign the same position
-        for i in range(0, len(leaderboard)):
-            current = leaderboard[i]
-            previous = leaderboard[i - 1]
-            if (current['total_score'] == previous['total_score'] and
-                current['goal_difference'] == previous['goal_difference'] and
-                current['goals_scored'] == previous['goals_scored']):
-                current['position'] = previous.get('position', 1)
-            else:
-                current['position'] = i + 1
-
-        return leaderboard
+        from .cache import cached
+        from .leaderboard import get_leaderboard
+        with metrics.LEADERBOARD_SECONDS.time():
+            return cached('leaderboard', self.start_time.year, self.competition_id, self.id, compute=lambda: get_leaderboard(self))
 
     def get_deadlines(self):
         """Return the deadlines for all users in this game."""
-        leaderboard = self.get_leaderboard()
+        from .cache import cached
+        from .leaderboard import get_deadlines
+        with metrics.DEADLINES_SECONDS.time():
+            return cached('deadlines', self.start_time.year, self.competition_id, self.id, compute=lambda: get_deadlines(self))
 
+    def calculate_deadlines(self, leaderboard):
+        """Return the deadlines for all users on the leaderboard at the start of this game."""
         # Check unique positions in leaderboard
         unique_positions = set(entry['position'] for entry in leaderboard)
         if len(unique_positions) == 1 or self.start_time.year <= 2024:
@@ -271,13 +138,11 @@ class Game(models.Model):
         return user_deadlines
 
     def get_deadline(self, user):
-        """Dynamically calculates the submission deadline for this user in this game."""
+        """Return the submission deadline for this user in this game."""
         if not user.is_authenticated:
             return None  # No deadline for anonymous users
 
-        deadlines = self.get_deadlines()
-
-        return deadlines.get(user.id, None)
+        return self.get_deadlines().get(user)
 
 
 class Bet(models.Model):
@@ -287,6 +152,8 @@ class Bet(models.Model):
     home_goals = models.PositiveSmallIntegerField(default=0)
     away_goals = models.PositiveSmallIntegerField(default=0)
     points = models.PositiveSmallIntegerField(default=0)
+    # Hidden field to keep track of whether the bet is included in the season totals of the user
+    counted = models.BooleanField(default=False, editable=False)
     # Hidden fields to keep track of creation and update time
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField()
@@ -338,25 +205,24 @@ class Bet(models.Model):
 
     def can_submit(self):
         """Check if the user can still submit or modify this bet."""
-        deadline = self.game.get_deadlines().get(self.user, self.game.start_time)
+        deadline = self.game.get_deadline(self.user) or self.game.start_time
         return timezone.now() <= deadline
 
     def save(self, *args, game_updated=False, **kwargs):
         ''' Update of the save method to restrict saving after the game has started '''
         if self.game.start_time <= timezone.now() and not game_updated:
+            metrics.BET_SUBMISSIONS.inc(result='rejected_started')
             raise ValidationError('Cannot save bet for a game that has already started.')
-        if not self.can_submit() and not game_updated:
+        if not game_updated and not self.can_submit():
+            metrics.BET_SUBMISSIONS.inc(result='rejected_deadline')
             raise ValidationError('Cannot save bet after your deadline.')
         if not game_updated:
             self.updated = timezone.now()
         self.points = self.calculate_points()
+        self.counted = self.game.has_started() and not self.game.competition.excluded
         super().save(*args, **kwargs)
-
-
-@receiver(post_save, sender=Game)
-def update_bet_points(sender, instance, **kwargs):
-    for bet in instance.bets.all():
-        bet.save(game_updated=True)
+        if not game_updated:
+            metrics.BET_SUBMISSIONS.inc(result='accepted')
 
 
 class StandingPrediction(models.Model):
@@ -382,35 +248,50 @@ class StandingPrediction(models.Model):
 
     def calculate_points(self, standing, TOP_BOTTOM=4, POINTS_CORRECT=6, POINTS_ALMOST=2):
         ''' Returns the points for the standings bet '''
-        points = 0
-        standing = [(team_position.position, team_position.team) for team_position in standing.team_positions.all().prefetch_related("team").order_by('position')]
-
-        if self.competition == 3:
-            predicted_standing = [Team.objects.get(team_id) for team_id in self.standing.split(',')]
-            for position, team in enumerate(predicted_standing):
-                diff = position - standing.index(team)
-                points -= abs(diff)
-            return points
-
-        top_teams = standing[:TOP_BOTTOM]
-        bottom_teams = standing[-TOP_BOTTOM:]
-
-        predicted_standing = [(prediction.position, prediction.team) for prediction in self.team_positions.all().prefetch_related("team").order_by('position')]
-        predicted_top_teams = predicted_standing[:TOP_BOTTOM]
-        predicted_bottom_teams = predicted_standing[-TOP_BOTTOM:]
-
-        for position, team in predicted_top_teams:
-            if (position, team) in top_teams:
-                points += POINTS_CORRECT
-            elif team in [tup[1] for tup in top_teams]:
-                points += POINTS_ALMOST
-
-        for position, team in predicted_bottom_teams:
-            if (position, team) in bottom_teams:
-                points += POINTS_CORRECT
-            elif team in [tup[1] for tup in bottom_teams]:
-                points += POINTS_ALMOST
+        standing = list(standing.team_positions.values_list('position', 'team_id').order_by('position'))
+        predicted_standing = list(self.team_positions.values_list('position', 'team_id').order_by('position'))
+        if self.competition_id == 3:
+            return self.position_difference_points(predicted_standing, standing)
+        return self.top_bottom_points(predicted_standing, standing, TOP_BOTTOM, POINTS_CORRECT, POINTS_ALMOST)
+
+    @classmethod
+    def calculate_points_for_competition(cls, competition, standing=None, TOP_BOTTOM=4, POINTS_CORRECT=6, POINTS_ALMOST=2):
+        ''' Returns the points of every standings bet of the competition as a {user: points} map '''
+        if standing is None:
+            standing = Standing.objects.filter(competition=competition).latest('round')
+        standing = list(standing.team_positions.values_list('position', 'team_id').order_by('position'))
+
+        predicted_standings = {}
+        predictions = StandingPredictionTeam.objects.filter(standing_prediction__competition=competition).order_by('standing_prediction', 'position')
+        for standing_prediction_id, position, team_id in predictions.values_list('standing_prediction_id', 'position', 'team_id'):
+            predicted_standings.setdefault(standing_prediction_id, []).append((position, team_id))
+
+        points = {}
+        for standing_prediction in cls.objects.select_related('user').filter(competition=competition):
+            predicted_standing = predicted_standings.get(standing_prediction.id, [])
+            if getattr(competition, 'id', competition) == 3:
+                points[standing_prediction.user] = cls.position_difference_points(predicted_standing, standing)
+            else:
+                points[standing_prediction.user] = cls.top_bottom_points(predicted_standing, standing, TOP_BOTTOM, POINTS_CORRECT, POINTS_ALMOST)
+        return points
 
+    @staticmethod
+    def position_difference_points(predicted_standing, standing):
+        ''' Scores a predicted standing with minus the distance of each team to its actual position, both given as lists of (position, team_id) '''
+        actual_positions = dict((team_id, position) for position, team_id in standing)
+        return -sum(abs(position - actual_positions.get(team_id, position)) for position, team_id in predicted_standing)
+
+    @staticmethod
+    def top_bottom_points(predicted_standing, standing, TOP_BOTTOM=4, POINTS_CORRECT=6, POINTS_ALMOST=2):
+        ''' Scores a predicted standing on the top and bottom teams, both given as lists of (position, team_id) '''
+        points = 0
+        for predicted, actual in ((predicted_standing[:TOP_BOTTOM], standing[:TOP_BOTTOM]), (predicted_standing[-TOP_BOTTOM:], standing[-TOP_BOTTOM:])):
+            actual_positions = dict((team_id, position) for position, team_id in actual)
+            for position, team_id in predicted:
+                if actual_positions.get(team_id) == position:
+                    points += POINTS_CORRECT
+                elif team_id in actual_positions:
+                    points += POINTS_ALMOST
         return points
 
 
@@ -500,3 +381,57 @@ class TeamPosition(models.Model):
     def save(self, *args, **kwargs):
         self.clean()  # Validate the team and position before saving
         super(TeamPosition, self).save(*args, **kwargs)
+
+
+class LeaderboardSnapshot(models.Model):
+    ''' The stored leaderboard row of a user at the start of a specific game '''
+    game = models.ForeignKey(Game, on_delete=models.CASCADE, related_name='leaderboard_snapshots')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    game_points = models.IntegerField(default=0)
+    goal_difference = models.IntegerField(default=0)
+    goals_scored = models.IntegerField(default=0)
+    table_points = models.IntegerField(default=0)
+    extra_bet = models.IntegerField(default=0)
+    total_score = models.IntegerField(default=0)
+    position = models.PositiveSmallIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['game', 'user'],
+                name='one_snapshot_per_user_per_game'
+            )
+        ]
+
+
+class BetDeadline(models.Model):
+    ''' The stored submission deadline of a user for a specific game '''
+    game = models.ForeignKey(Game, on_delete=models.CASCADE, related_name='deadlines')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    deadline = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['game', 'user'],
+                name='one_deadline_per_user_per_game'
+            )
+        ]
+
+
+class UserSeasonScore(models.Model):
+    ''' The running totals of the counted game bets of a user during a year '''
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='season_scores')
+    year = models.PositiveSmallIntegerField()
+    points = models.IntegerField(default=0)
+    goal_diff = models.IntegerField(default=0)
+    goals_scored_diff = models.IntegerField(default=0)
+    bets_count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['year', 'user'],
+                name='one_score_per_user_per_year'
+            )
+        ]
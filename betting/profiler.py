@@ -0,0 +1,132 @@
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+
+from django.core.cache import cache
+
+# The profiler is switched on for all workers through the cache, which each worker checks at most this often
+CHECK_INTERVAL = 1
+SAMPLE_INTERVAL = 0.005
+TARGET_KEY = 'betting:profiler:target'
+STACKS_KEY = 'betting:profiler:stacks'
+# Guards the shared stacks while a worker merges its samples into them, expiring should the worker die holding it
+LOCK_KEY = 'betting:profiler:lock'
+LOCK_TIMEOUT = 5
+LOCK_POLL_INTERVAL = 0.005
+
+_local_target = {'checked_at': 0.0, 'target': None}
+# One request per worker is sampled at a time
+_sampling_lock = threading.Lock()
+
+
+def start_profiling(url_name, seconds):
+    ''' Switches the profiler on for requests to the URL name during the given number of seconds '''
+    cache.set(TARGET_KEY, {'url_name': url_name, 'until': time.time() + seconds}, seconds)
+    _local_target['checked_at'] = 0.0
+
+
+def stop_profiling():
+    cache.delete(TARGET_KEY)
+    _local_target['checked_at'] = 0.0
+
+
+def profiling_target():
+    ''' Returns the URL name and end time of the profiling, or None, looking it up in the cache at most once per CHECK_INTERVAL '''
+    now = time.time()
+    if now - _local_target['checked_at'] >= CHECK_INTERVAL:
+        _local_target['target'] = cache.get(TARGET_KEY)
+        _local_target['checked_at'] = now
+    target = _local_target['target']
+    return target if target and target['until'] > now else None
+
+
+def should_profile(url_name):
+    target = profiling_target()
+    return target is not None and target['url_name'] == url_name
+
+
+def frame_name(frame):
+    return f'{frame.f_globals.get("__name__", "?")}.{getattr(frame.f_code, "co_qualname", frame.f_code.co_name)}'
+
+
+class StackSampler(threading.Thread):
+    ''' Samples the stack of another thread until stopped, counting the folded stacks, root first '''
+
+    def __init__(self, thread_id):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(SAMPLE_INTERVAL):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                names.append(frame_name(frame))
+                frame = frame.f_back
+            if names:
+                self.stacks[';'.join(reversed(names))] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        return self.stacks
+
+
+def start_sampler():
+    ''' Starts sampling the current thread, or returns None while this worker samples another request '''
+    if not _sampling_lock.acquire(blocking=False):
+        return None
+    sampler = StackSampler(threading.get_ident())
+    sampler.start()
+    return sampler
+
+
+def finish_sampler(sampler):
+    ''' Stops the sampler and adds its stacks to the ones shared by all workers '''
+    try:
+        stacks = sampler.stop()
+    finally:
+        _sampling_lock.release()
+    if stacks:
+        add_stacks(stacks)
+
+
+@contextmanager
+def stacks_lock():
+    ''' Holds the lock on the shared stacks, waiting for other workers to release it '''
+    token = uuid.uuid4().hex
+    while not cache.add(LOCK_KEY, token, LOCK_TIMEOUT):
+        time.sleep(LOCK_POLL_INTERVAL)
+    try:
+        yield
+    finally:
+        if cache.get(LOCK_KEY) == token:
+            cache.delete(LOCK_KEY)
+
+
+def add_stacks(stacks):
+    ''' Adds counted stacks to the shared ones, so samples of requests finishing at once are not lost '''
+    with stacks_lock():
+        shared = Counter(cache.get(STACKS_KEY) or {})
+        shared.update(stacks)
+        cache.set(STACKS_KEY, dict(shared), None)
+
+
+def folded_stacks():
+    ''' Returns the collected stacks in the folded format of flamegraph.pl and speedscope, one "stack count" per line '''
+    stacks = cache.get(STACKS_KEY) or {}
+    return ''.join(f'{stack} {count}\n' for stack, count in sorted(stacks.items()))
+
+
+def sample_count():
+    return sum((cache.get(STACKS_KEY) or {}).values())
+
+
+def clear_stacks():
+    with stacks_lock():
+        cache.delete(STACKS_KEY)
@@ -0,0 +1,123 @@
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+from .leaderboard import invalidate_leaderboards
+from .models import Game, Bet, UserSeasonScore
+from .standings import goal_difference_expression, goals_scored_expression
+
+SEASON_SCORE_FIELDS = ['points', 'goal_diff', 'goals_scored_diff', 'bets_count']
+
+
+def rescore_games(games):
+    ''' Recalculates the points of every bet on the games and writes the changed ones back in bulk
+
+    The season totals of the users are updated by the difference between what each bet added before and after.
+    '''
+    games = {game.id: game for game in games}
+    changed_bets = []
+    deltas = {}
+    for bet in Bet.objects.filter(game_id__in=games):
+        game = games[bet.game_id]
+        bet.game = game
+        points = bet.calculate_points()
+        counted = game.has_started() and not game.competition.excluded
+        if bet.counted:
+            previous_state = getattr(game, 'previous_score_state', None) or game.score_state()
+            add_contribution(deltas, bet.user_id, season_contribution(bet.home_goals, bet.away_goals, bet.points, previous_state), -1)
+        if counted:
+            add_contribution(deltas, bet.user_id, season_contribution(bet.home_goals, bet.away_goals, points, game.score_state()))
+        if points != bet.points or counted != bet.counted:
+            bet.points = points
+            bet.counted = counted
+            changed_bets.append(bet)
+
+    with transaction.atomic():
+        Bet.objects.bulk_update(changed_bets, ['points', 'counted'], batch_size=500)
+        apply_season_deltas(deltas)
+
+    for game in games.values():
+        game.previous_score_state = game.score_state()
+
+    return len(changed_bets)
+
+
+def rescore_season(year):
+    ''' Recalculates the points of every bet placed during a year '''
+    games = Game.objects.select_related('competition').filter(start_time__year=year)
+    changed = rescore_games(games)
+    invalidate_leaderboards(year)
+    return changed
+
+
+def season_contribution(home_goals, away_goals, points, game_state):
+    ''' Returns the year, points, goal difference and goals scored difference a counted bet adds to the season totals '''
+    game_home_goals, game_away_goals, start_time, home_team_id = game_state
+    if home_team_id == 1:
+        goal_diff = (home_goals - away_goals) - (game_home_goals - game_away_goals)
+        goals_scored_diff = home_goals - game_home_goals
+    else:
+        goal_diff = (away_goals - home_goals) - (game_away_goals - game_home_goals)
+        goals_scored_diff = away_goals - game_away_goals
+    return timezone.localtime(start_time).year, points, goal_diff, goals_scored_diff
+
+
+def add_contribution(deltas, user_id, contribution, sign=1):
+    ''' Adds (or with sign -1 removes) the contribution of a bet to the deltas per user and year '''
+    year, *values = contribution
+    totals = deltas.setdefault((user_id, year), [0, 0, 0, 0])
+    for i, value in enumerate(values + [1]):
+        totals[i] += sign * value
+
+
+def apply_season_deltas(deltas):
+    ''' Applies the deltas per user and year to the stored season totals with a constant number of queries '''
+    deltas = {key: values for key, values in deltas.items() if any(values)}
+    if not deltas:
+        return
+
+    with transaction.atomic():
+        season_scores = {
+            (season_score.user_id, season_score.year): season_score
+            for season_score in UserSeasonScore.objects.select_for_update().filter(
+                user_id__in={user_id for user_id, _ in deltas},
+                year__in={year for _, year in deltas},
+            )
+        }
+        new_season_scores = []
+        for (user_id, year), values in deltas.items():
+            season_score = season_scores.get((user_id, year))
+            if season_score is None:
+                season_score = UserSeasonScore(user_id=user_id, year=year)
+                new_season_scores.append(season_score)
+            for field, value in zip(SEASON_SCORE_FIELDS, values):
+                setattr(season_score, field, getattr(season_score, field) + value)
+
+        UserSeasonScore.objects.bulk_update(list(season_scores.values()), SEASON_SCORE_FIELDS, batch_size=500)
+        UserSeasonScore.objects.bulk_create(new_season_scores)
+
+
+def compute_season_scores(year):
+    ''' Returns the season totals of the year per user, aggregated from the counted bets '''
+    totals = (
+        Bet.objects.filter(counted=True, game__start_time__year=year)
+        .values('user')
+        .annotate(
+            points=Sum('points'),
+            goal_diff=Sum(goal_difference_expression()),
+            goals_scored_diff=Sum(goals_scored_expression()),
+            bets_count=Count('id'),
+        )
+        .order_by('user')
+    )
+    return {row.pop('user'): row for row in totals}
+
+
+def rebuild_season_scores(year):
+    ''' Replaces the stored season totals of the year with totals aggregated from the counted bets '''
+    with transaction.atomic():
+        UserSeasonScore.objects.filter(year=year).delete()
+        UserSeasonScore.objects.bulk_create([
+            UserSeasonScore(user_id=user_id, year=year, **totals)
+            for user_id, totals in compute_season_scores(year).items()
+        ])
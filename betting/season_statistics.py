@@ -0,0 +1,124 @@
+from array import array
+from itertools import groupby
+from operator import itemgetter
+
+from django.db.models import Count, Max
+
+from .cache import cached
+from .models import Game, Bet
+
+POINTS_COLUMNS = {0: 'zero_points', 1: 'one_point', 3: 'three_points', 4: 'four_points', 6: 'six_points'}
+LAST_GAMES = (5, 10, 15)
+
+
+def get_statistics(year, current_datetime):
+    ''' Returns the statistics of the started games of the year, cached until the results change or another game starts '''
+    games = Game.objects.filter(start_time__lt=current_datetime, start_time__year=year, competition__excluded=False)
+    started = games.aggregate(count=Count('id'), last_start_time=Max('start_time'))
+    return cached(
+        'statistics', year, started['count'], started['last_start_time'] and started['last_start_time'].timestamp(),
+        compute=lambda: SeasonStatistics(year, current_datetime).summary()
+    )
+
+
+class SeasonStatistics:
+    ''' Points of all bets on the started games of a year, stored as one compact array per column
+
+    Each bet is a (game index, user index, points) triple, so distributions, totals, the sums over the last
+    N games and the cumulative series of every user are computed in a single pass over the arrays.
+    '''
+
+    def __init__(self, year, current_datetime):
+        self.games = list(
+            Game.objects
+            .filter(start_time__lt=current_datetime, start_time__year=year, competition__excluded=False)
+            .values('id', 'start_time', 'home_team__name', 'away_team__name')
+            .order_by('start_time', 'id')
+        )
+        game_index = {game['id']: i for i, game in enumerate(self.games)}
+
+        self.user_ids = []
+        self.first_names = []
+        user_index = {}
+        self.bet_games = array('i')
+        self.bet_users = array('i')
+        self.bet_points = array('h')
+
+        bets = Bet.objects.filter(
+            game__start_time__lt=current_datetime,
+            game__start_time__year=year,
+            game__competition__excluded=False
+        ).values_list('game_id', 'user_id', 'user__first_name', 'points')
+        for game_id, user_id, first_name, points in bets:
+            if user_id not in user_index:
+                user_index[user_id] = len(self.user_ids)
+                self.user_ids.append(user_id)
+                self.first_names.append(first_name)
+            self.bet_games.append(game_index[game_id])
+            self.bet_users.append(user_index[user_id])
+            self.bet_points.append(points)
+
+    def summary(self, last_games=LAST_GAMES):
+        ''' Returns the statistics table, the list of users and the cumulative points per game '''
+        number_of_users = len(self.user_ids)
+        number_of_games = len(self.games)
+        bets = array('i', [0]) * number_of_users
+        totals = array('i', [0]) * number_of_users
+        distribution = {points: array('i', [0]) * number_of_users for points in POINTS_COLUMNS}
+        last_bets = {n: array('i', [0]) * number_of_users for n in last_games}
+        last_totals = {n: array('i', [0]) * number_of_users for n in last_games}
+        game_points = [array('i', [0]) * number_of_games for _ in range(number_of_users)]
+        first_game = array('i', [number_of_games]) * number_of_users
+
+        for game, user, points in zip(self.bet_games, self.bet_users, self.bet_points):
+            bets[user] += 1
+            totals[user] += points
+            if points in distribution:
+                distribution[points][user] += 1
+            for n in last_games:
+                if game >= number_of_games - n:
+                    last_bets[n][user] += 1
+                    last_totals[n][user] += points
+            game_points[user][game] += points
+            first_game[user] = min(first_game[user], game)
+
+        stats_table = []
+        for user in range(number_of_users):
+            row = {
+                'user__first_name': self.first_names[user],
+                'total_bets': bets[user],
+                'total_points': totals[user],
+                'average_points': round(totals[user] / bets[user], 2),
+            }
+            for points, column in POINTS_COLUMNS.items():
+                row[column] = distribution[points][user]
+            for n in last_games:
+                row[f'total_points_last_{n}'] = last_totals[n][user] if last_bets[n][user] else None
+                row[f'average_points_last_{n}'] = round(last_totals[n][user] / last_bets[n][user], 2) if last_bets[n][user] else None
+            stats_table.append(row)
+        stats_table.sort(key=lambda row: (-row['total_points'], row['user__first_name']))
+
+        user_list = sorted(
+            ({'user__id': user_id, 'user__first_name': first_name} for user_id, first_name in zip(self.user_ids, self.first_names)),
+            key=itemgetter('user__first_name')
+        )
+
+        return {'stats_table': stats_table, 'user_list': user_list, 'game_stats': self.cumulative_points(game_points, first_game)}
+
+    def cumulative_points(self, game_points, first_game):
+        ''' Returns one row per game with the points of every user up to and including the games starting at the same time '''
+        game_stats = []
+        cumulative = array('i', [0]) * len(self.user_ids)
+        index = 0
+        for _, games in groupby(self.games, key=itemgetter('start_time')):
+            games = list(games)
+            for game in range(index, index + len(games)):
+                for user, points in enumerate(game_points):
+                    cumulative[user] += points[game]
+            index += len(games)
+            for game in games:
+                row = {key: game[key] for key in ('id', 'start_time', 'home_team__name', 'away_team__name')}
+                for user, user_id in enumerate(self.user_ids):
+                    row[f'user_{user_id}_cumulative_points'] = cumulative[user] if first_game[user] < index else None
+                game_stats.append(row)
+        return game_stats
@@ -0,0 +1,99 @@
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from . import metrics
+from .cache import bump_version
+from .leaderboard import invalidate_leaderboards
+from .models import Team, Game, Bet, Competition, StandingPrediction, StandingPredictionTeam, Standing, TeamPosition
+from .scoring import rescore_games, season_contribution, add_contribution, apply_season_deltas
+
+
+def competition_year(competition_id):
+    ''' Returns the season of the competition as a year, or None for seasons like 22/23 '''
+    season = Competition.objects.filter(pk=competition_id).values_list('season', flat=True).first()
+    return int(season) if season and season.isdigit() else None
+
+
+@receiver(pre_save, sender=Game)
+def remember_score_state(sender, instance, **kwargs):
+    if instance.pk:
+        instance.previous_score_state = Game.objects.filter(pk=instance.pk).values_list(*Game.SCORE_FIELDS).first()
+
+
+@receiver(post_save, sender=Game)
+def update_bet_points(sender, instance, **kwargs):
+    # Invalidate after the new points are written, so nothing read in between outlives the change
+    with metrics.RESCORE_SECONDS.time():
+        rescore_games([instance])
+    invalidate_leaderboards(instance.start_time.year)
+
+
+@receiver(post_delete, sender=Game)
+def invalidate_game_leaderboards(sender, instance, **kwargs):
+    invalidate_leaderboards(instance.start_time.year, after=instance.start_time)
+
+
+@receiver(pre_save, sender=Bet)
+def remember_bet_contribution(sender, instance, **kwargs):
+    instance.previous_contribution = None
+    # Only bets on started games can be counted in the season totals
+    if instance.pk and instance.game.has_started():
+        previous = Bet.objects.filter(pk=instance.pk, counted=True).values_list('user_id', 'home_goals', 'away_goals', 'points', 'game_id').first()
+        if previous:
+            user_id, home_goals, away_goals, points, game_id = previous
+            game = instance.game if game_id == instance.game_id else Game.objects.get(pk=game_id)
+            instance.previous_contribution = (user_id, season_contribution(home_goals, away_goals, points, game.score_state()))
+
+
+@receiver(post_save, sender=Bet)
+def update_bet_season_score(sender, instance, **kwargs):
+    deltas = {}
+    if getattr(instance, 'previous_contribution', None):
+        user_id, contribution = instance.previous_contribution
+        add_contribution(deltas, user_id, contribution, -1)
+    if instance.counted:
+        add_contribution(deltas, instance.user_id, season_contribution(instance.home_goals, instance.away_goals, instance.points, instance.game.score_state()))
+    apply_season_deltas(deltas)
+    instance.previous_contribution = None
+
+
+@receiver(post_delete, sender=Bet)
+def remove_bet_season_score(sender, instance, **kwargs):
+    if instance.counted:
+        deltas = {}
+        add_contribution(deltas, instance.user_id, season_contribution(instance.home_goals, instance.away_goals, instance.points, instance.game.score_state()), -1)
+        apply_season_deltas(deltas)
+
+
+@receiver(post_save, sender=Bet)
+@receiver(post_delete, sender=Bet)
+def invalidate_bet_leaderboards(sender, instance, **kwargs):
+    invalidate_leaderboards(instance.game.start_time.year, after=instance.game.start_time)
+
+
+@receiver(post_save, sender=Standing)
+@receiver(post_delete, sender=Standing)
+@receiver(post_save, sender=StandingPrediction)
+@receiver(post_delete, sender=StandingPrediction)
+def invalidate_standing_leaderboards(sender, instance, **kwargs):
+    year = competition_year(instance.competition_id)
+    if year is not None:
+        invalidate_leaderboards(year)
+
+
+@receiver(post_save, sender=TeamPosition)
+@receiver(post_delete, sender=TeamPosition)
+def invalidate_team_position_leaderboards(sender, instance, **kwargs):
+    year = competition_year(instance.standing.competition_id)
+    if year is not None:
+        invalidate_leaderboards(year)
+
+
+@receiver(post_save, sender=Team)
+@receiver(post_delete, sender=Team)
+@receiver(post_save, sender=Competition)
+@receiver(post_delete, sender=Competition)
+@receiver(post_save, sender=StandingPredictionTeam)
+@receiver(post_delete, sender=StandingPredictionTeam)
+def bump_pages_version(sender, instance, **kwargs):
+    bump_version()
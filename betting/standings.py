@@ -0,0 +1,113 @@
+from django.db.models import Case, When, F, IntegerField
+
+from .models import Competition, StandingPrediction, Standing, UserSeasonScore
+
+TOP_SCORER_2023 = 'Isaac Kiese Thelin'
+MOST_ASSISTS_2023 = 'Mikkel Rygaard Jensen'
+TABLE_POINTS_2022 = {
+    1: 12,
+    2: 12,
+    3: 12,
+    4: 14,
+    5: 12,
+    6: 18,
+    7: 14,
+    8: 14,
+}
+COMPETITIONS = {
+    '2023': 3,
+    '2024': 8,
+    '2025': 13,
+    '2026': 17,
+}
+
+
+def goal_difference_expression():
+    ''' Difference between the predicted and the actual goal difference, seen from Malmö FF '''
+    return Case(
+        When(game__home_team__id=1, then=(F('home_goals') - F('away_goals')) - (F('game__home_goals') - F('game__away_goals'))),
+        default=(F('away_goals') - F('home_goals')) - (F('game__away_goals') - F('game__home_goals')),
+        output_field=IntegerField()
+    )
+
+
+def goals_scored_expression():
+    ''' Difference between the predicted and the actual number of goals scored by Malmö FF '''
+    return Case(
+        When(game__home_team__id=1, then=F('home_goals') - F('game__home_goals')),
+        default=F('away_goals') - F('game__away_goals'),
+        output_field=IntegerField()
+    )
+
+
+def compute_standings(selected_year):
+    ''' Returns the ranked standings of all users with counted bets during the year '''
+    season_scores = UserSeasonScore.objects.select_related('user').filter(year=int(selected_year), bets_count__gt=0).order_by('user')
+
+    standings = None
+    predictions = {}
+    prediction_points = {}
+    if selected_year in COMPETITIONS:
+        competition = Competition.objects.get(pk=COMPETITIONS[selected_year])
+        predictions = {
+            prediction.user_id: prediction
+            for prediction in StandingPrediction.objects.filter(competition=competition)
+        }
+        if selected_year != '2023':
+            standings = Standing.objects.filter(competition=competition).latest('round')
+        if selected_year == '2024':
+            prediction_points = StandingPrediction.calculate_points_for_competition(competition, standings, 4, 6, 2)
+
+    result = []
+    for season_score in season_scores:
+        prediction = predictions.get(season_score.user_id)
+        if selected_year == '2022':
+            user_table_points = TABLE_POINTS_2022.get(season_score.user_id, 0)
+        elif selected_year == '2024':
+            user_table_points = prediction_points.get(season_score.user, 0)
+        else:
+            user_table_points = 0
+
+        result.append({
+            'user': season_score.user,
+            'points': season_score.points,
+            'table_points': user_table_points,
+            'top_scorer': prediction.top_scorer if prediction else 'N/A',
+            'most_assists': prediction.most_assists if prediction else 'N/A',
+            'most_points': prediction.most_points if prediction else 'N/A',
+            'clean_sheets': prediction.clean_sheets if prediction else 'N/A',
+            'goal_diff': season_score.goal_diff,
+            'goals_scored_diff': season_score.goals_scored_diff,
+        })
+
+    top_scorer_list = []
+    most_assists_list = []
+    if selected_year == '2023':
+        top_scorer_list = TOP_SCORER_2023
+        most_assists_list = MOST_ASSISTS_2023
+    elif selected_year in ('2024', '2025'):
+        top_scorer_list = standings.top_scorer
+        most_assists_list = standings.most_assists
+
+    for row in result:
+        row['extra_bet'] = 0
+        for top_scorer in row['top_scorer'].split(', '):
+            if top_scorer in top_scorer_list:
+                row['extra_bet'] += 6
+        for most_assist in row['most_assists'].split(', '):
+            if most_assist in most_assists_list:
+                row['extra_bet'] += 6
+        row['total_points'] = row['points'] + row['table_points'] + row['extra_bet']
+
+    result.sort(key=lambda row: (-row['total_points'], abs(row['goal_diff']), abs(row['goals_scored_diff'])))
+
+    # Users with the same points, goal difference and goals scored share the same rank
+    previous = None
+    for i, row in enumerate(result):
+        current = (row['total_points'], abs(row['goal_diff']), abs(row['goals_scored_diff']))
+        if current != previous:
+            rank = i + 1
+            previous = current
+        row['rank'] = rank
+
+    return result
@@ -0,0 +1,83 @@
+def ordered_standings(teams, team_ids):
+    ''' Returns (position, team) pairs of the teams in the order of the list of team ids '''
+    order = {team_id: i for i, team_id in enumerate(team_ids)}
+    return list(enumerate(sorted(teams, key=lambda team: order[team.id]), 1))
+
+
+def predicted_teams(standing_prediction):
+    ''' Returns the predicted (position, team) pairs of a standing prediction '''
+    return [(standing_prediction_team.position, standing_prediction_team.team) for standing_prediction_team in standing_prediction.team_positions.all()]
+
+
+def prediction_row(standing_prediction, teams, bet_points):
+    ''' Returns the summary row of a scored standing prediction '''
+    return {
+        'user': standing_prediction.user,
+        'teams': teams,
+        'bet_points': bet_points,
+        'points': sum(bet_points),
+        'top_scorer': standing_prediction.top_scorer,
+        'most_assists': standing_prediction.most_assists,
+        'most_points': standing_prediction.most_points,
+        'clean_sheets': standing_prediction.clean_sheets
+    }
+
+
+def score_position_difference(current_standings, standing_predictions):
+    ''' Scores each predicted team with minus the distance to its actual position in the standings '''
+    actual_positions = {team.id: position for position, team in current_standings}
+
+    rows = []
+    for standing_prediction in standing_predictions:
+        teams = predicted_teams(standing_prediction)
+        bet_points = [-abs(position - actual_positions.get(team.id, position)) for position, team in teams]
+        rows.append(prediction_row(standing_prediction, teams, bet_points))
+
+    return rows
+
+
+def score_top_bottom(current_standings, standing_predictions, TOP_BOTTOM, POINTS_CORRECT, POINTS_ALMOST):
+    ''' Scores the predicted top and bottom teams against the (position, team) pairs of the standings '''
+    top_positions = {team.id: position for position, team in current_standings[:TOP_BOTTOM]}
+    bottom_positions = {team.id: position for position, team in current_standings[-TOP_BOTTOM:]}
+
+    def points(position, team, actual_positions):
+        if actual_positions.get(team.id) == position:
+            return POINTS_CORRECT
+        if team.id in actual_positions:
+            return POINTS_ALMOST
+        return 0
+
+    rows = []
+    for standing_prediction in standing_predictions:
+        teams = predicted_teams(standing_prediction)
+        top_teams = teams[:TOP_BOTTOM]
+        bottom_teams = teams[-TOP_BOTTOM:]
+        bet_points = [points(position, team, top_positions) for position, team in top_teams]
+        bet_points += [points(position, team, bottom_positions) for position, team in bottom_teams]
+        row = prediction_row(standing_prediction, top_teams + bottom_teams, bet_points)
+        row['top_teams'] = top_teams
+        row['bottom_teams'] = bottom_teams
+        rows.append(row)
+
+    return rows
+
+
+def standing_grid(current_standings, rows):
+    ''' One grid row per (position, team) pair with the n:th predicted team and points of every prediction '''
+    grid = []
+    for i, (position, team) in enumerate(current_standings):
+        grid.append([((position, team), 0)] + [(row['teams'][i], row['bet_points'][i]) for row in rows])
+    return grid
+
+
+def position_grid(current_standings, rows):
+    ''' One grid row per position with the team and points of every prediction placed there, or an empty cell '''
+    predicted_positions = [
+        {position: ((position, team), bet_points) for (position, team), bet_points in zip(row['teams'], row['bet_points'])}
+        for row in rows
+    ]
+    return [
+        [((position, team), 0)] + [positions.get(position, ((position, ), )) for positions in predicted_positions]
+        for position, team in current_standings
+    ]
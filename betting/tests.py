@@ -1,11 +1,39 @@
+import io
+import json
 import os
-from django.test import TestCase
+import stat
+import tempfile
+import threading
+import time
+import tracemalloc
+import unittest.mock as mock
+from collections import Counter
+
 from django.contrib.auth import get_user_model
-from django.core.exceptions import ValidationError
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured, ValidationError
 from django.core.files.uploadedfile import SimpleUploadedFile
-from .models import Bet, Team, Competition, Game, StandingPrediction
+from django.core.management import call_command, CommandError
+from django.db import OperationalError, connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
-import unittest.mock as mock
+
+from . import metrics, profiler
+from .cache import bump_version, cache_stats, current_version, get_version, reset_request_memo, version_key
+from .cache_backend import SQLiteCache
+from .charts import build_chart_data
+from .leaderboard import compute_leaderboards, LeaderboardIndex, get_leaderboard, get_deadlines, get_deadlines_for_games, get_leaderboard_index
+from .management.commands._harness import measure
+from .management.commands.benchmark_views import budget_violations
+from .management.commands.replay_season import summarize, timed_request
+from .middleware import normalize_sql, slow_queries, allocation_profiles
+from .models import Bet, Team, Competition, Game, StandingPrediction, StandingPredictionTeam, Standing, TeamPosition, UserSeasonScore, LeaderboardSnapshot, BetDeadline
+from .scoring import rescore_games, rebuild_season_scores, compute_season_scores
+from .season_statistics import SeasonStatistics, get_statistics
+from .standings import compute_standings
+from .table_bets import ordered_standings, score_position_difference, score_top_bottom, standing_grid, position_grid
+from .views import deadline_calendar_token
 
 # Create your tests here.
 class TeamModelTest(TestCase):
@@ -255,6 +283,811 @@ class BetModelTest(TestCase):
         with self.assertRaises(ValidationError):
             bet.full_clean()
 
+class LeaderboardSnapshotTest(TestCase):
+    def setUp(self):
+        current_year = timezone.now().year
+        self.user1 = get_user_model().objects.create_user(username='user1', password='testpassword', first_name='Anna')
+        self.user2 = get_user_model().objects.create_user(username='user2', password='testpassword', first_name='Bertil')
+        self.team1 = Team.objects.create(name='Malmö FF')
+        self.team2 = Team.objects.create(name='IFK Göteborg')
+        self.competition = Competition.objects.create(name='Allsvenskan', season=current_year)
+        self.game1 = Game.objects.create(
+            competition=self.competition,
+            home_team=self.team1,
+            away_team=self.team2,
+            start_time=timezone.now() + timezone.timedelta(hours=1),
+        )
+        self.game2 = Game.objects.create(
+            competition=self.competition,
+            home_team=self.team2,
+            away_team=self.team1,
+            start_time=timezone.now() + timezone.timedelta(hours=2),
+        )
+        Bet.objects.create(game=self.game1, user=self.user1, home_goals=2, away_goals=0)
+        Bet.objects.create(game=self.game1, user=self.user2, home_goals=0, away_goals=1)
+
+    def finish_game1(self, home_goals, away_goals):
+        self.game1.start_time = timezone.now() - timezone.timedelta(hours=2)
+        self.game1.home_goals = home_goals
+        self.game1.away_goals = away_goals
+        self.game1.save()
+
+    def test_leaderboard_is_stored_as_snapshot(self):
+        self.finish_game1(2, 0)
+        leaderboard = self.game2.get_leaderboard()
+        self.assertEqual([row['user'] for row in leaderboard], [self.user1, self.user2])
+        self.assertEqual(leaderboard[0]['game_points'], 6)
+        self.assertEqual(LeaderboardSnapshot.objects.filter(game=self.game2).count(), 2)
+
+    def test_stored_snapshot_is_read_with_a_single_query(self):
+        self.finish_game1(2, 0)
+        leaderboard = get_leaderboard(self.game2)
+        with self.assertNumQueries(1):
+            self.assertEqual(get_leaderboard(self.game2), leaderboard)
+
+    def test_snapshot_computed_during_a_change_is_not_served(self):
+        self.finish_game1(2, 0)
+        stale = compute_leaderboards([self.game2])[self.game2]
+
+        def compute_during_change(game):
+            self.finish_game1(0, 1)
+            return stale
+
+        with mock.patch.object(LeaderboardIndex, 'leaderboard_for', side_effect=compute_during_change):
+            self.assertEqual(get_leaderboard(self.game2)[0]['user'], self.user1)
+        self.assertEqual(get_leaderboard(self.game2)[0]['user'], self.user2)
+
+    def test_missing_snapshot_is_looked_up_in_the_cached_index(self):
+        self.finish_game1(2, 0)
+        get_leaderboard_index(self.game2)
+        with CaptureQueriesContext(connection) as queries:
+            leaderboard = get_leaderboard(self.game2)
+        self.assertFalse([query['sql'] for query in queries.captured_queries if 'FROM "betting_bet"' in query['sql']])
+        self.assertEqual(leaderboard, compute_leaderboards([self.game2])[self.game2])
+        self.assertEqual(LeaderboardSnapshot.objects.filter(game=self.game2).count(), 2)
+
+    def test_deadlines_are_stored(self):
+        self.finish_game1(2, 0)
+        deadlines = self.game2.get_deadlines()
+        self.assertEqual(set(deadlines), {self.user1, self.user2})
+        self.assertEqual(BetDeadline.objects.filter(game=self.game2).count(), 2)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.game2.get_deadline(self.user1), deadlines[self.user1])
+
+    def test_leaderboard_read_while_a_result_is_saved_is_not_kept(self):
+        def read_then_rescore(games):
+            self.game2.get_leaderboard()
+            return rescore_games(games)
+
+        with mock.patch('betting.signals.rescore_games', side_effect=read_then_rescore):
+            self.finish_game1(2, 0)
+        self.assertEqual(self.game2.get_leaderboard()[0]['game_points'], 6)
+        self.assertEqual(self.game2.get_deadlines(), self.game2.calculate_deadlines(compute_leaderboards([self.game2])[self.game2]))
+
+    def test_deadlines_calculated_during_a_change_are_not_served(self):
+        self.finish_game1(2, 0)
+        stale = {self.user1: self.game2.start_time, self.user2: self.game2.start_time}
+
+        def calculate_during_change(leaderboard):
+            self.finish_game1(0, 1)
+            return stale
+
+        with mock.patch.object(Game, 'calculate_deadlines', side_effect=calculate_during_change):
+            self.assertEqual(get_deadlines(self.game2), stale)
+        self.assertNotEqual(get_deadlines(self.game2), stale)
+        self.assertEqual(get_deadlines_for_games([self.game1, self.game2])[self.game2], get_deadlines(self.game2))
+
+    def test_bet_on_game_does_not_invalidate_its_own_deadlines(self):
+        self.game2.get_deadlines()
+        Bet.objects.create(game=self.game2, user=self.user1, home_goals=1, away_goals=1)
+        self.assertEqual(BetDeadline.objects.filter(game=self.game2).count(), 2)
+
+    def test_compute_leaderboards_for_many_games(self):
+        self.finish_game1(1, 0)
+        game3 = Game.objects.create(
+            competition=self.competition,
+            home_team=self.team1,
+            away_team=self.team2,
+            start_time=timezone.now() + timezone.timedelta(hours=3),
+        )
+        leaderboards = compute_leaderboards([self.game1, self.game2, game3])
+        self.assertEqual(leaderboards[self.game2], leaderboards[game3])
+        self.assertEqual([(row['user'], row['game_points'], row['goal_difference'], row['goals_scored']) for row in leaderboards[self.game2]], [(self.user1, 4, 1, 1), (self.user2, 0, -2, -1)])
+        self.assertEqual({row['user'] for row in leaderboards[self.game1]}, {self.user1, self.user2})
+        self.assertTrue(all(row['total_score'] == 0 for row in leaderboards[self.game1]))
+
+    def test_leaderboard_index_lookup_at_any_game(self):
+        self.finish_game1(0, 1)
+        game3 = Game.objects.create(
+            competition=self.competition,
+            home_team=self.team1,
+            away_team=self.team2,
+            start_time=timezone.now() + timezone.timedelta(hours=3),
+        )
+        Bet.objects.create(game=self.game2, user=self.user1, home_goals=1, away_goals=2)
+        Game.objects.filter(pk=self.game2.pk).update(start_time=timezone.now() - timezone.timedelta(hours=1), home_goals=1, away_goals=2)
+        self.game2.refresh_from_db()
+        self.game2.save()
+
+        index = LeaderboardIndex.for_game(game3)
+        self.assertEqual(index.start_times, [self.game1.start_time, self.game2.start_time])
+        with self.assertNumQueries(0):
+            previous = index.leaderboard_for(self.game2)
+            current = index.leaderboard_for(game3)
+        self.assertEqual(previous, compute_leaderboards([self.game2])[self.game2])
+        self.assertEqual(current, compute_leaderboards([game3])[game3])
+        self.assertEqual({row['user']: row['game_points'] for row in current}, {self.user1: 6, self.user2: 6})
+
+    def test_with_deadlines_attaches_user_deadline(self):
+        self.finish_game1(0, 1)
+        games = Game.objects.select_related('competition').order_by('start_time').with_deadlines(self.user1)
+        self.assertFalse(BetDeadline.objects.exists())
+        self.assertFalse(LeaderboardSnapshot.objects.exists())
+        self.assertEqual([game.user_deadline for game in games], [game.get_deadline(self.user1) for game in games])
+        self.assertLess(games[1].user_deadline, games[1].start_time)
+        anonymous_games = Game.objects.all().with_deadlines(mock.Mock(is_authenticated=False))
+        self.assertEqual([game.user_deadline for game in anonymous_games], [None, None])
+
+    def test_result_change_invalidates_snapshot(self):
+        self.finish_game1(2, 0)
+        self.assertEqual(self.game2.get_leaderboard()[0]['user'], self.user1)
+        self.finish_game1(0, 1)
+        leaderboard = self.game2.get_leaderboard()
+        self.assertEqual(leaderboard[0]['user'], self.user2)
+        self.assertEqual(leaderboard[0]['position'], 1)
+        self.assertEqual(leaderboard[1]['position'], 2)
+
+
+
+class LeaderboardCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(username='user1', password='testpassword')
+        self.staff_user = get_user_model().objects.create_user(username='staff', password='testpassword', is_staff=True)
+        self.team1 = Team.objects.create(name='Malmö FF')
+        self.team2 = Team.objects.create(name='IFK Göteborg')
+        self.competition = Competition.objects.create(name='Allsvenskan', season=timezone.now().year)
+        Standing.objects.create(competition=self.competition, round=1)
+        self.game = Game.objects.create(
+            competition=self.competition,
+            home_team=self.team1,
+            away_team=self.team2,
+            start_time=timezone.now() + timezone.timedelta(hours=1),
+        )
+        reset_request_memo(None)
+        self.stats = cache_stats()
+
+    def lookups(self):
+        ''' Returns the lookups counted since the test started '''
+        return {counter: cache_stats()[counter] - self.stats[counter] for counter in ('misses', 'request_hits', 'cache_hits')}
+
+    def test_leaderboard_is_memoized_within_and_cached_across_requests(self):
+        leaderboard = self.game.get_leaderboard()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.game.get_leaderboard(), leaderboard)
+        reset_request_memo(None)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.game.get_leaderboard(), leaderboard)
+        self.assertEqual(self.lookups(), {'misses': 2, 'request_hits': 1, 'cache_hits': 1})
+
+    def test_warm_lookups_do_not_write_to_the_cache(self):
+        self.game.get_leaderboard()
+        reset_request_memo(None)
+        with mock.patch.object(cache, 'add') as add, mock.patch.object(cache, 'incr') as incr, mock.patch.object(cache, 'set') as cache_set:
+            self.game.get_leaderboard()
+            self.game.get_leaderboard()
+        add.assert_not_called()
+        incr.assert_not_called()
+        cache_set.assert_not_called()
+
+    def test_saving_bet_invalidates_cache(self):
+        self.game.get_deadlines()
+        version = get_version(self.game.start_time.year)
+        Bet.objects.create(game=self.game, user=self.user, home_goals=1, away_goals=0)
+        self.assertGreater(get_version(self.game.start_time.year), version)
+        self.game.get_deadlines()
+        self.assertEqual(self.lookups()['misses'], 3)
+
+    def test_concurrent_bumps_do_not_move_the_version_into_the_future(self):
+        year = self.game.start_time.year
+        now = int(time.time() * 1000)
+        cache.set(version_key(year), now - 10 ** 6, None)
+        # Both bumps read the version before either of them writes it
+        barrier = threading.Barrier(2)
+        get = SQLiteCache.get
+
+        def get_together(backend, *args, **kwargs):
+            value = get(backend, *args, **kwargs)
+            barrier.wait(timeout=5)
+            return value
+
+        # Each thread has a cache backend of its own
+        with mock.patch('time.time', return_value=now / 1000), mock.patch.object(SQLiteCache, 'get', autospec=True, side_effect=get_together):
+            threads = [threading.Thread(target=bump_version, args=(year,)) for _ in range(2)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(current_version(year), now + 1)
+
+    def test_leaderboard_index_is_cached_until_a_bet_is_saved(self):
+        index = get_leaderboard_index(self.game)
+        reset_request_memo(None)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_leaderboard_index(self.game).leaderboard_for(self.game), index.leaderboard_for(self.game))
+        Bet.objects.create(game=self.game, user=self.user, home_goals=1, away_goals=0)
+        with CaptureQueriesContext(connection) as queries:
+            get_leaderboard_index(self.game)
+        self.assertTrue(queries.captured_queries)
+
+    def test_cache_stats_are_staff_only(self):
+        self.client.login(username='user1', password='testpassword')
+        self.assertEqual(self.client.get('/betting/cache-stats/').status_code, 302)
+        self.client.login(username='staff', password='testpassword')
+        response = self.client.get('/betting/cache-stats/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('hit_ratio', response.json())
+
+class RescoringTest(TestCase):
+    def setUp(self):
+        current_year = timezone.now().year
+        self.team1 = Team.objects.create(name='Malmö FF')
+        self.team2 = Team.objects.create(name='IFK Göteborg')
+        self.competition = Competition.objects.create(name='Allsvenskan', season=current_year)
+        self.game = Game.objects.create(
+            competition=self.competition,
+            home_team=self.team1,
+            away_team=self.team2,
+            start_time=timezone.now() + timezone.timedelta(hours=1),
+        )
+        results = [(2, 0), (1, 1), (0, 1), (2, 1), (3, 0)]
+        for i, (home_goals, away_goals) in enumerate(results):
+            user = get_user_model().objects.create_user(username=f'user{i}', password='testpassword')
+            Bet.objects.create(game=self.game, user=user, home_goals=home_goals, away_goals=away_goals)
+        Game.objects.filter(pk=self.game.pk).update(start_time=timezone.now() - timezone.timedelta(hours=2), home_goals=2, away_goals=0)
+        self.game.refresh_from_db()
+
+    def test_rescore_games_uses_bet_points_rules(self):
+        self.assertEqual(rescore_games([self.game]), 5)
+        points = {bet.result(): bet.points for bet in self.game.bets.all()}
+        self.assertEqual(points, {'2-0': 6, '1-1': 0, '0-1': 0, '2-1': 4, '3-0': 4})
+
+    def test_rescore_games_query_count_does_not_depend_on_number_of_bets(self):
+        def unscore():
+            Bet.objects.filter(game=self.game).update(points=0, counted=False)
+            UserSeasonScore.objects.all().delete()
+            return Game.objects.get(pk=self.game.pk)
+
+        game = unscore()
+        with CaptureQueriesContext(connection) as few_bets:
+            self.assertEqual(rescore_games([game]), 5)
+        users = [get_user_model().objects.create_user(username=f'extra{i}', password='testpassword') for i in range(20)]
+        Bet.objects.bulk_create([Bet(game=self.game, user=user, home_goals=i % 3, away_goals=0, updated=timezone.now()) for i, user in enumerate(users)])
+        game = unscore()
+        with CaptureQueriesContext(connection) as many_bets:
+            self.assertEqual(rescore_games([game]), 25)
+        self.assertEqual(len(many_bets.captured_queries), len(few_bets.captured_queries))
+
+    def test_saving_game_result_rescores_bets(self):
+        self.game.away_goals = 1
+        self.game.save()
+        points = {bet.result(): bet.points for bet in self.game.bets.all()}
+        self.assertEqual(points, {'2-0': 4, '1-1': 1, '0-1': 1, '2-1': 6, '3-0': 3})
+
+    def test_rescore_season_command(self):
+        output = io.StringIO()
+        call_command('rescore_season', str(self.game.start_time.year), stdout=output)
+        self.assertIn(f'{self.game.start_time.year}: updated points for', output.getvalue())
+        self.assertEqual(self.game.bets.get(home_goals=2, away_goals=0).points, 6)
+
+    def test_season_scores_follow_result_corrections(self):
+        year = self.game.start_time.year
+        rescore_games([self.game])
+        self.game.away_goals = 1
+        self.game.save()
+        season_scores = {season_score.user_id: (season_score.points, season_score.bets_count) for season_score in UserSeasonScore.objects.filter(year=year)}
+        self.assertEqual(season_scores, {bet.user_id: (bet.points, 1) for bet in self.game.bets.all()})
+        self.assertEqual({season_score.user_id: {field: getattr(season_score, field) for field in ('points', 'goal_diff', 'goals_scored_diff', 'bets_count')} for season_score in UserSeasonScore.objects.filter(year=year)}, compute_season_scores(year))
+
+    def test_deleting_counted_bet_updates_season_score(self):
+        rescore_games([self.game])
+        bet = self.game.bets.get(home_goals=2, away_goals=0)
+        bet.delete()
+        season_score = UserSeasonScore.objects.get(user=bet.user, year=self.game.start_time.year)
+        self.assertEqual((season_score.points, season_score.bets_count), (0, 0))
+
+    def test_verify_season_scores_command(self):
+        year = self.game.start_time.year
+        rescore_games([self.game])
+        UserSeasonScore.objects.filter(year=year).update(points=0)
+        with open(os.devnull, 'w') as devnull:
+            call_command('verify_season_scores', str(year), '--fix', stdout=devnull)
+        self.assertEqual(UserSeasonScore.objects.get(user__bet__home_goals=2, user__bet__away_goals=0, year=year).points, 6)
+
+
+class SeedBettingTest(TestCase):
+    def seed(self, *args):
+        with open(os.devnull, 'w') as devnull:
+            call_command('seed_betting', '--users', '3', '--seasons', '2', '--games', '6', '--cup-games', '1', *args, stdout=devnull)
+
+    def test_seed_betting_creates_consistent_seasons(self):
+        self.seed()
+        year = timezone.now().year
+        self.assertEqual(get_user_model().objects.filter(username__startswith='seed-').count(), 3)
+        self.assertEqual(Game.objects.filter(start_time__year=year).count(), 7)
+        self.assertEqual(Team.objects.get(pk=1).name, 'Malmö FF')
+        for bet in Bet.objects.select_related('game__competition')[:20]:
+            self.assertEqual(bet.points, bet.calculate_points())
+        for season in (year - 1, year):
+            stored = {season_score.user_id: {field: getattr(season_score, field) for field in ('points', 'goal_diff', 'goals_scored_diff', 'bets_count')} for season_score in UserSeasonScore.objects.filter(year=season)}
+            self.assertEqual(stored, compute_season_scores(season))
+
+    def test_seed_betting_refuses_existing_prefix(self):
+        self.seed()
+        with self.assertRaises(CommandError):
+            self.seed()
+        self.seed('--prefix', 'other')
+        self.assertEqual(get_user_model().objects.filter(username__startswith='other-').count(), 3)
+
+
+class BenchmarkTest(TestCase):
+    def result(self, queries, selects, status=200):
+        run = {'queries': queries, 'selects': selects, 'sql_ms': 0, 'wall_ms': 0}
+        return {'status': status, 'bytes': 0, 'cold': run, 'warm': run}
+
+    def test_budget_violations_flag_reads_growing_with_users(self):
+        sizes = {
+            '10': {'index': self.result(10, 8), 'world-cup-bet': self.result(5, 5)},
+            '200': {'index': self.result(12, 8), 'world-cup-bet': self.result(195, 195, status=500)},
+        }
+        violations = budget_violations(sizes)
+        self.assertEqual(len(violations), 4)
+        self.assertTrue(all(violation.startswith('world-cup-bet') for violation in violations))
+
+    def test_measure_counts_queries_of_a_page(self):
+        result = measure(self.client, '/betting/team/')
+        self.assertEqual((result['status'], result['queries'], result['selects']), (200, 1, 1))
+        self.assertGreater(result['bytes'], 0)
+
+    def test_replay_summary_counts_lock_errors(self):
+        def locked():
+            raise OperationalError('database is locked')
+
+        outcomes = [timed_request('bet', locked), timed_request('detail', lambda: self.client.get('/betting/team/'))]
+        summary = summarize(outcomes, seconds=2)
+        self.assertEqual((summary['requests'], summary['errors'], summary['lock_errors'], summary['throughput']), (2, 0, 1, 1.0))
+        self.assertLessEqual(summary['p50'], summary['p99'])
+
+
+class InstrumentationTest(TestCase):
+    @override_settings(REQUEST_TIMING_SAMPLE_RATE=1)
+    def test_sampled_request_has_timings(self):
+        with self.assertLogs('betting.timing') as logs:
+            response = self.client.get('/betting/team/')
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="1 queries", tpl;dur=[\d.]+, view;dur=[\d.]+, total;dur=[\d.]+$')
+        entry = json.loads(logs.records[0].getMessage())
+        self.assertEqual((entry['view'], entry['status'], entry['queries']), ('betting:list-team', 200, 1))
+        self.assertGreater(entry['tpl_ms'], 0)
+
+    @override_settings(REQUEST_TIMING_SAMPLE_RATE=0)
+    def test_unsampled_request_has_no_timings(self):
+        self.assertNotIn('Server-Timing', self.client.get('/betting/team/'))
+
+    def test_normalize_sql_groups_queries_by_shape(self):
+        self.assertEqual(
+            normalize_sql('SELECT * FROM "betting_bet" WHERE ("game_id" IN (%s, %s, %s) AND "points" > 3)'),
+            normalize_sql("SELECT * FROM \"betting_bet\"  WHERE (\"game_id\" IN (%s) AND \"points\" > 'x')"),
+        )
+
+    @override_settings(SLOW_QUERY_THRESHOLD_MS=0)
+    def test_slow_queries_are_shown_to_staff(self):
+        slow_queries.clear()
+        self.client.get('/betting/team/')
+        self.assertEqual(slow_queries[-1]['view'], 'betting:list-team')
+        self.assertIn('betting/views.py', slow_queries[-1]['stack'][-1])
+
+        staff = get_user_model().objects.create_user(username='staff', password='testpassword', is_staff=True)
+        self.client.force_login(staff)
+        response = self.client.get('/betting/slow-queries/')
+        self.assertContains(response, 'betting:list-team')
+        self.assertContains(response, 'FROM &quot;betting_team&quot;')
+
+    @override_settings(ALLOCATION_PROFILING_URL_NAMES=['betting:list-team'], ALLOCATION_PROFILING_SAMPLE_RATE=1)
+    def test_allocations_of_selected_views_are_profiled(self):
+        with self.assertLogs('betting.allocations') as logs:
+            self.client.get('/betting/team/')
+            self.client.get('/betting/login/')
+        self.assertEqual(len(logs.records), 1)
+        profile = json.loads(logs.records[0].getMessage())
+        self.assertEqual(profile['view'], 'betting:list-team')
+        self.assertGreater(profile['peak_kb'], 0)
+        self.assertTrue(profile['top_lines'])
+        self.assertEqual(allocation_profiles[-1], profile)
+        self.assertFalse(tracemalloc.is_tracing())
+
+    def test_profiler_collects_folded_stacks_of_selected_view(self):
+        staff = get_user_model().objects.create_user(username='staff', password='testpassword', is_staff=True)
+        self.client.force_login(staff)
+        self.client.post('/betting/profiler/', {'action': 'start', 'url_name': 'betting:list-team', 'minutes': 1})
+        self.assertContains(self.client.get('/betting/profiler/'), 'Profilerar <strong>betting:list-team</strong>')
+        with mock.patch('betting.views.Team.objects.all', side_effect=lambda: time.sleep(0.05) or Team.objects.none()):
+            self.client.get('/betting/team/')
+        self.client.post('/betting/profiler/', {'action': 'stop'})
+
+        response = self.client.get('/betting/profiler/stacks.txt')
+        stacks = response.content.decode().splitlines()
+        self.assertTrue(stacks)
+        self.assertTrue(any('betting.views.team_list' in line for line in stacks))
+        self.assertTrue(all(line.rsplit(' ', 1)[1].isdigit() for line in stacks))
+        self.assertIsNone(profiler.profiling_target())
+        profiler.clear_stacks()
+
+
+    def test_stacks_of_concurrent_requests_are_all_kept(self):
+        profiler.clear_stacks()
+        threads = [threading.Thread(target=profiler.add_stacks, args=(Counter({'a;b': 1, f'c;{i}': 2}),)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(profiler.sample_count(), 24)
+        self.assertIn('a;b 8\n', profiler.folded_stacks())
+        profiler.clear_stacks()
+
+    def test_profiler_rejects_invalid_minutes(self):
+        staff = get_user_model().objects.create_user(username='staff', password='testpassword', is_staff=True)
+        self.client.force_login(staff)
+        response = self.client.post('/betting/profiler/', {'action': 'start', 'url_name': 'betting:list-team', 'minutes': 'fem'}, follow=True)
+        self.assertContains(response, 'Ange antalet minuter')
+        self.assertIsNone(profiler.profiling_target())
+
+
+class MetricsTest(TestCase):
+    def setUp(self):
+        self.metrics_dir = tempfile.TemporaryDirectory()
+        self.settings_override = override_settings(METRICS_DIR=self.metrics_dir.name)
+        self.settings_override.enable()
+        self.user = get_user_model().objects.create_user(username='user', password='testpassword')
+        competition = Competition.objects.create(name='Allsvenskan', season=timezone.now().year)
+        self.game = Game.objects.create(
+            competition=competition,
+            home_team=Team.objects.create(name='Malmö FF'),
+            away_team=Team.objects.create(name='IFK Göteborg'),
+            start_time=timezone.now() + timezone.timedelta(hours=1),
+        )
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.metrics_dir.cleanup()
+
+    def value(self, text, line_start):
+        return float(next(line for line in text.splitlines() if line.startswith(line_start)).rsplit(' ', 1)[1])
+
+    def test_metrics_count_bets_and_requests(self):
+        before = metrics.render()
+        Bet.objects.create(game=self.game, user=self.user, home_goals=1, away_goals=0)
+        Game.objects.filter(pk=self.game.pk).update(start_time=timezone.now() - timezone.timedelta(minutes=1))
+        self.game.refresh_from_db()
+        with self.assertRaises(ValidationError):
+            Bet.objects.create(game=self.game, user=self.user, home_goals=2, away_goals=0)
+        self.client.get('/betting/team/')
+
+        get_user_model().objects.create_user(username='staff', password='testpassword', is_staff=True)
+        self.client.login(username='staff', password='testpassword')
+        after = self.client.get('/metrics').content.decode()
+        accepted = 'betting_bet_submissions_total{result="accepted"}'
+        rejected = 'betting_bet_submissions_total{result="rejected_started"}'
+        self.assertEqual(self.value(after, accepted) - (self.value(before, accepted) if accepted in before else 0), 1)
+        self.assertEqual(self.value(after, rejected) - (self.value(before, rejected) if rejected in before else 0), 1)
+        self.assertIn('betting_request_queries_bucket{view="betting:list-team",le="+Inf"}', after)
+        self.assertIn('# TYPE betting_get_leaderboard_seconds histogram', after)
+
+    def test_metrics_add_up_the_files_of_all_workers(self):
+        metrics.flush()
+        own = metrics.collect().get('betting_bet_submissions_total', {})
+        with open(metrics.process_file(os.getppid()), 'w') as file:
+            json.dump({'betting_bet_submissions_total': {'["accepted"]': 5}}, file)
+        with open(metrics.process_file(2 ** 22 + 1), 'w') as file:
+            json.dump({'betting_bet_submissions_total': {'["accepted"]': 7}}, file)
+        merged = metrics.collect()['betting_bet_submissions_total']
+        self.assertEqual(merged['["accepted"]'], own.get('["accepted"]', 0) + 5)
+        self.assertFalse(os.path.exists(metrics.process_file(2 ** 22 + 1)))
+
+    def test_failed_flush_is_logged_without_failing_the_request(self):
+        metrics._last_flush['time'] = 0.0
+        with mock.patch('betting.metrics.os.replace', side_effect=FileNotFoundError), self.assertLogs('betting.metrics', 'ERROR'):
+            self.assertEqual(self.client.get('/betting/team/').status_code, 200)
+        self.assertEqual(os.listdir(self.metrics_dir.name), [])
+
+    def test_metrics_are_internal(self):
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.1').status_code, 403)
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_metrics_need_the_token_at_internal_addresses(self):
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.1', HTTP_AUTHORIZATION='Bearer secret').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+
+
+class SQLiteCacheTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = SQLiteCache(os.path.join(self.directory.name, 'cache.sqlite3'), {'OPTIONS': {'MAX_ENTRIES': 10, 'CULL_FREQUENCY': 2}})
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_cache_file_is_private_to_its_owner(self):
+        self.cache.set('key', 'value')
+        self.assertEqual(stat.S_IMODE(os.stat(self.cache.location).st_mode), 0o600)
+        with mock.patch('betting.cache_backend.os.geteuid', return_value=os.geteuid() + 1):
+            with self.assertRaises(ImproperlyConfigured):
+                SQLiteCache(self.cache.location, {}).get('key')
+
+    def test_set_get_add_and_expiry(self):
+        self.cache.set('key', {'value': [1, 2]})
+        self.assertEqual(self.cache.get('key'), {'value': [1, 2]})
+        self.assertFalse(self.cache.add('key', 'other'))
+        self.cache.set('expired', 'value', 0)
+        self.assertIsNone(self.cache.get('expired'))
+        self.assertTrue(self.cache.add('expired', 'new'))
+        self.assertEqual(self.cache.get('expired'), 'new')
+        self.assertTrue(self.cache.delete('key'))
+        self.assertEqual(self.cache.get('key', 'default'), 'default')
+
+    def test_concurrent_increments_are_not_lost(self):
+        self.cache.set('counter', 0, None)
+
+        def increment():
+            for _ in range(50):
+                self.cache.incr('counter')
+
+        threads = [threading.Thread(target=increment) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.cache.get('counter'), 200)
+        with self.assertRaises(ValueError):
+            self.cache.incr('missing')
+
+    def test_advance_moves_to_the_later_of_one_more_and_the_minimum(self):
+        self.assertEqual(self.cache.advance('version', 1000, None), 1000)
+        self.assertEqual(self.cache.advance('version', 1000, None), 1001)
+        self.assertEqual(self.cache.advance('version', 5000, None), 5000)
+        values = []
+
+        def advance():
+            for _ in range(25):
+                values.append(self.cache.advance('version', 5000, None))
+
+        threads = [threading.Thread(target=advance) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(values), list(range(5001, 5101)))
+
+    def test_least_recently_used_entries_are_evicted(self):
+        with mock.patch('betting.cache_backend.CULL_EVERY', 1):
+            for i in range(10):
+                with mock.patch('time.time', return_value=1000 + i):
+                    self.cache.set(f'key{i}', i, None)
+            with mock.patch('time.time', return_value=2000):
+                self.cache.get('key0')
+                self.cache.set('key10', 10, None)
+        self.assertEqual(self.cache.get('key0'), 0)
+        self.assertIsNone(self.cache.get('key1'))
+        self.assertEqual(self.cache.get('key10'), 10)
+
+
+class SQLitePragmasTest(TestCase):
+    def test_new_connections_get_the_pragmas(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 5000)
+
+
+class StandingsTest(TestCase):
+    def setUp(self):
+        self.team1 = Team.objects.create(name='Malmö FF')
+        self.team2 = Team.objects.create(name='IFK Göteborg')
+        self.competition = Competition.objects.create(pk=17, name='Allsvenskan', season='2026')
+        self.competition.teams.add(self.team1, self.team2)
+        Standing.objects.create(competition=self.competition, round=1)
+        self.start_time = timezone.make_aware(timezone.datetime(2026, 5, 1, 15))
+        self.game1 = Game.objects.create(competition=self.competition, home_team=self.team1, away_team=self.team2, start_time=self.start_time, home_goals=2, away_goals=1)
+        self.game2 = Game.objects.create(competition=self.competition, home_team=self.team2, away_team=self.team1, start_time=self.start_time + timezone.timedelta(days=7), home_goals=0, away_goals=0)
+        self.now = self.start_time + timezone.timedelta(days=30)
+
+    def add_user(self, i, first_game_result, second_game_result):
+        user = get_user_model().objects.create_user(username=f'user{i}', password='testpassword', first_name=f'User {i}')
+        for game, (home_goals, away_goals) in ((self.game1, first_game_result), (self.game2, second_game_result)):
+            bet = Bet(game=game, user=user, home_goals=home_goals, away_goals=away_goals, updated=self.start_time)
+            with mock.patch('django.utils.timezone.now', return_value=self.now):
+                bet.points = bet.calculate_points()
+            bet.counted = True
+            Bet.objects.bulk_create([bet])
+        StandingPrediction.objects.create(user=user, competition=self.competition, top_scorer='Player A, Player B')
+        rebuild_season_scores(2026)
+        return user
+
+    def test_standings_are_ranked(self):
+        user1 = self.add_user(1, (2, 1), (0, 0))
+        user2 = self.add_user(2, (1, 0), (0, 1))
+        user3 = self.add_user(3, (1, 0), (0, 1))
+        result = compute_standings('2026')
+        self.assertEqual([row['user'] for row in result], [user1, user2, user3])
+        self.assertEqual([row['rank'] for row in result], [1, 2, 2])
+        self.assertEqual([(row['points'], row['goal_diff'], row['goals_scored_diff']) for row in result[:2]], [(12, 0, 0), (4, 1, 0)])
+
+    def test_query_count_does_not_depend_on_number_of_users(self):
+        for i in range(2):
+            self.add_user(i, (1, 0), (0, 1))
+        with CaptureQueriesContext(connection) as few_users:
+            compute_standings('2026')
+        for i in range(2, 10):
+            self.add_user(i, (i % 3, 1), (1, i % 2))
+        with CaptureQueriesContext(connection) as many_users:
+            self.assertEqual(len(compute_standings('2026')), 10)
+        self.assertEqual(len(few_users), len(many_users))
+
+
+
+class StatisticsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user1 = get_user_model().objects.create_user(username='user1', password='testpassword', first_name='Anna')
+        self.user2 = get_user_model().objects.create_user(username='user2', password='testpassword', first_name='Bertil')
+        self.team1 = Team.objects.create(name='Malmö FF')
+        self.team2 = Team.objects.create(name='IFK Göteborg')
+        self.competition = Competition.objects.create(name='Allsvenskan', season='2026')
+        start_time = timezone.make_aware(timezone.datetime(2026, 5, 1, 15))
+        self.games = [
+            Game.objects.create(competition=self.competition, home_team=self.team1, away_team=self.team2, start_time=start_time + timezone.timedelta(days=days), home_goals=1, away_goals=0)
+            for days in (0, 7, 7)
+        ]
+        bets = [(self.user1, self.games[0], 6), (self.user1, self.games[1], 3), (self.user2, self.games[2], 4)]
+        Bet.objects.bulk_create([Bet(game=game, user=user, points=points, updated=start_time) for user, game, points in bets])
+        self.now = start_time + timezone.timedelta(days=30)
+
+    def test_summary(self):
+        summary = SeasonStatistics(2026, self.now).summary(last_games=(1, 2))
+        self.assertEqual([row['user__first_name'] for row in summary['stats_table']], ['Anna', 'Bertil'])
+        anna = summary['stats_table'][0]
+        self.assertEqual((anna['total_bets'], anna['total_points'], anna['average_points'], anna['six_points'], anna['three_points']), (2, 9, 4.5, 1, 1))
+        self.assertEqual((anna['total_points_last_1'], anna['total_points_last_2'], anna['average_points_last_2']), (None, 3, 3.0))
+        cumulative = [(row[f'user_{self.user1.id}_cumulative_points'], row[f'user_{self.user2.id}_cumulative_points']) for row in summary['game_stats']]
+        self.assertEqual(cumulative, [(6, None), (9, 4), (9, 4)])
+
+    def test_statistics_are_cached(self):
+        statistics = get_statistics(2026, self.now)
+        reset_request_memo(None)
+        with self.assertNumQueries(1):
+            self.assertEqual(get_statistics(2026, self.now), statistics)
+
+    def test_pages_answer_conditional_requests_without_queries(self):
+        url = '/betting/statistics/2026/'
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Bet.objects.filter(user=self.user2).delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_chart_data(self):
+        chart_data = build_chart_data(self.competition.id, self.now)
+        self.assertEqual(chart_data['labels'], ['2026-05-01 13:00', '2026-05-08 13:00'])
+        self.assertEqual(chart_data['datasets'], [
+            {'label': 'Anna', 'offset': 0, 'data': [6, 9]},
+            {'label': 'Bertil', 'offset': 1, 'data': [4]},
+        ])
+        self.assertEqual(build_chart_data(self.competition.id, self.now, 'delta')['datasets'][0]['data'], [6, 3])
+
+    def test_chart_data_view_supports_conditional_requests(self):
+        url = f'/betting/chart-data-view/{self.competition.id}/'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.has_header('Last-Modified'))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        Bet.objects.filter(user=self.user2).delete()
+        self.games[0].save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+
+class CalendarFeedTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.team1 = Team.objects.create(name='Malmö FF')
+        self.team2 = Team.objects.create(name='IFK Göteborg')
+        self.competition = Competition.objects.create(name='Allsvenskan', season='2026')
+        self.other_competition = Competition.objects.create(name='Svenska Cupen', season='2025')
+        Standing.objects.create(competition=self.competition, round=1)
+        start_time = timezone.make_aware(timezone.datetime(2026, 5, 1, 15))
+        for competition in (self.competition, self.other_competition):
+            Game.objects.create(competition=competition, home_team=self.team1, away_team=self.team2, start_time=start_time)
+        reset_request_memo(None)
+
+    def test_feed_is_rendered_once_per_version(self):
+        response = self.client.get('/betting/game/feed.ics')
+        self.assertEqual(response.content.count(b'BEGIN:VEVENT'), 2)
+        reset_request_memo(None)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/betting/game/feed.ics').content, response.content)
+        self.assertEqual(self.client.get('/betting/game/feed.ics', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_personal_deadline_feed(self):
+        user = get_user_model().objects.create_user(username='user1', password='testpassword')
+        game = Game.objects.create(competition=self.competition, home_team=self.team1, away_team=self.team2, start_time=timezone.now() + timezone.timedelta(days=1))
+        url = f'/betting/game/deadlines/{deadline_calendar_token(user)}/feed.ics'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(f'UID:Deadline-{game.id}@Bettingkingarna'.encode(), response.content)
+        self.assertFalse(BetDeadline.objects.exists())
+        reset_request_memo(None)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).content, response.content)
+        self.assertEqual(self.client.get('/betting/game/deadlines/invalid/feed.ics').status_code, 404)
+
+    def test_feed_can_be_filtered(self):
+        response = self.client.get(f'/betting/game/feed.ics?competition={self.competition.id}')
+        self.assertEqual(response.content.count(b'BEGIN:VEVENT'), 1)
+        response = self.client.get('/betting/game/feed.ics?season=2025')
+        self.assertIn(b'Svenska Cupen 2025', response.content)
+        self.assertEqual(response.content.count(b'BEGIN:VEVENT'), 1)
+
+class TableBetScoringTest(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='testuser', password='testpassword')
+        self.teams = [Team.objects.create(name=f'Team {i}') for i in range(1, 5)]
+        self.competition = Competition.objects.create(name='Allsvenskan', season='2026')
+        self.competition.teams.add(*self.teams)
+        self.standing_prediction = StandingPrediction.objects.create(user=self.user, competition=self.competition)
+        for position, team in enumerate([self.teams[1], self.teams[0], self.teams[2], self.teams[3]], 1):
+            StandingPredictionTeam.objects.create(standing_prediction=self.standing_prediction, team=team, position=position)
+        self.current_standings = ordered_standings(self.competition.teams.all(), [team.id for team in self.teams])
+
+    def test_ordered_standings(self):
+        self.assertEqual(self.current_standings, list(enumerate(self.teams, 1)))
+
+    def test_score_position_difference(self):
+        rows = score_position_difference(self.current_standings, [self.standing_prediction])
+        self.assertEqual(rows[0]['bet_points'], [-1, -1, 0, 0])
+        self.assertEqual(rows[0]['points'], -2)
+        grid = standing_grid(self.current_standings, rows)
+        self.assertEqual(grid[0], [((1, self.teams[0]), 0), ((1, self.teams[1]), -1)])
+
+    def test_score_top_bottom(self):
+        rows = score_top_bottom(self.current_standings, [self.standing_prediction], 1, 6, 2)
+        self.assertEqual(rows[0]['teams'], [(1, self.teams[1]), (4, self.teams[3])])
+        self.assertEqual(rows[0]['bet_points'], [0, 6])
+
+    def test_position_grid(self):
+        rows = score_position_difference(self.current_standings, [self.standing_prediction])
+        grid = position_grid(self.current_standings, rows)
+        self.assertEqual(grid[1], [((2, self.teams[1]), 0), ((2, self.teams[0]), -1)])
+        self.assertEqual([len(grid_row) for grid_row in grid], [2] * len(self.current_standings))
+        rows[0]['teams'], rows[0]['bet_points'] = rows[0]['teams'][:2], rows[0]['bet_points'][:2]
+        self.assertEqual(position_grid(self.current_standings, rows)[3], [((4, self.teams[3]), 0), ((4, ), )])
+
+
+    def test_calculate_points_for_competition(self):
+        standing = Standing.objects.create(competition=self.competition, round=1)
+        for position, team in self.current_standings:
+            TeamPosition.objects.create(standing=standing, team=team, position=position)
+        other_user = get_user_model().objects.create_user(username='otheruser', password='testpassword')
+        other_prediction = StandingPrediction.objects.create(user=other_user, competition=self.competition)
+        for position, team in self.current_standings:
+            StandingPredictionTeam.objects.create(standing_prediction=other_prediction, team=team, position=position)
+
+        with self.assertNumQueries(3):
+            points = StandingPrediction.calculate_points_for_competition(self.competition, standing, 1, 6, 2)
+        self.assertEqual(points, {self.user: 6, other_user: 12})
+        self.assertEqual(self.standing_prediction.calculate_points(standing, 1, 6, 2), 6)
+        self.assertEqual(StandingPrediction.calculate_points_for_competition(self.competition, standing, 2, 6, 2)[self.user], 16)
+
 class StandingPredictionModelTest(TestCase):
     def setUp(self):
         current_year = timezone.now().year
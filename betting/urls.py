@@ -19,10 +19,15 @@ urlpatterns = [
     path('standing-prediction/<int:competition_id>/', views.standing_predictions_list, name='list-standing-prediction'),
     path('standing-prediction/suggestion/<int:competition_id>/', views.standing_predictions_suggestion, name='list-standing-suggestion'),
     path('statistics/<int:year>/', views.statistics, name='statistics'),
-    path('game/feed.ics', views.calendar_subscription(), name='calendar'),
+    path('game/feed.ics', views.calendar_feed, name='calendar'),
+    path('game/deadlines/<str:token>/feed.ics', views.deadline_calendar_feed, name='deadline-calendar'),
     path('table-bet/<int:competition_id>/', views.table_bet, name='table-bet'),
     path('table-bet/<int:competition_id>/summary/', views.table_bet_summary, name='table-bet-summary'),
     path('competition-overview/<int:competition_id>/', views.competition_overview, name='competition-overview'),
     path('chart-data-view/<int:competition_id>/', views.chart_data_view, name='chart-data-view'),
     path('world-cup-bet/<int:competition_id>/', views.world_cup_bet, name='world-cup-bet'),
+    path('cache-stats/', views.cache_stats, name='cache-stats'),
+    path('slow-queries/', views.slow_queries, name='slow-queries'),
+    path('profiler/', views.profiler_page, name='profiler'),
+    path('profiler/stacks.txt', views.profiler_stacks, name='profiler-stacks'),
 ]
@@ -1,25 +1,37 @@
+from django.conf import settings
 from django.utils import timezone
+from django.utils.crypto import constant_time_compare
 from django.contrib import messages
 from django.contrib.auth import authenticate, login, logout
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required, permission_required
 from django.db import transaction
-from django.db.models import Q, Count, Sum, Avg, Window, F, Case, When, IntegerField
-from django.db.models.functions import Round, Rank, Abs
+from django.db.models import Q, Count
 from django.forms import ValidationError
-from django.http import JsonResponse
+from django.core import signing
+from django.http import Http404, HttpResponse, HttpResponseForbidden, JsonResponse
 from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
+from django.views.decorators.http import condition
 from django_ical.views import ICalFeed
 from accounts.models import CustomUser
 from .forms import TeamForm, GameForm, BetForm, StandingPredictionForm, TableBetForm, TeamPositionBetForm
 from .models import Team, Competition, Game, Bet, StandingPrediction, StandingPredictionTeam, Standing, TeamPosition
+from .cache import ALL, cache_stats as betting_cache_stats, cached, conditional_page, get_version
+from .charts import chart_state, get_chart_data
+from . import metrics as betting_metrics, profiler
+from .leaderboard import get_leaderboard_index
+from .middleware import allocation_profiles, slow_queries as recent_slow_queries, slow_query_summary
+from .season_statistics import get_statistics
+from .standings import TOP_SCORER_2023, MOST_ASSISTS_2023, compute_standings
+from .table_bets import ordered_standings, score_position_difference, score_top_bottom, standing_grid, position_grid
 
 DEADLINE_2024 = timezone.make_aware(timezone.datetime(2024, 4, 7, 11))
 DEADLINE_2025 = timezone.make_aware(timezone.datetime(2025, 3, 29, 15))
 DEADLINE_2026 = timezone.make_aware(timezone.datetime(2026, 4, 5, 16, 30))
 DEADLINE_VM_2026 = timezone.make_aware(timezone.datetime(2026, 6, 11, 21, 00))
 ALLSVENSKAN_2023 = '1,18,23,3,5,4,6,13,11,15,7,29,22,30,8,24'
-TOP_SCORER_2023 = 'Isaac Kiese Thelin'
-MOST_ASSISTS_2023 = 'Mikkel Rygaard Jensen'
+DEADLINE_CALENDAR_SALT = 'betting.deadline-calendar'
 
 # Create your views here.
 
@@ -65,6 +77,7 @@ def team_list(request):
     return render(request, 'betting/team_list.html', context)
 
 
+@conditional_page
 def game_list(request):
     ''' Listing all past and upcoming games in the current year '''
     current_datetime = timezone.now()
@@ -77,10 +90,11 @@ def game_list(request):
 
     past_games, todays_games, upcoming_games = [], [], []
 
-    for game in all_games:
+    for game in all_games.with_deadlines(request.user):
         game_info = {
             'game': game,
-            'user_has_bet': game.id in user_bets
+            'user_has_bet': game.id in user_bets,
+            'deadline': game.user_deadline,
         }
 
         if game.start_time.date() == current_datetime.date():
@@ -95,6 +109,8 @@ def game_list(request):
         'todays_games': todays_games,
         'upcoming_games': upcoming_games,
     }
+    if request.user.is_authenticated:
+        context['deadline_calendar_url'] = request.build_absolute_uri(reverse('betting:deadline-calendar', args=[deadline_calendar_token(request.user)]))
 
     return render(request, 'betting/game_list.html', context)
 
@@ -248,6 +264,7 @@ def delete_bet(request, game_id, bet_id):
     return render(request, 'betting/delete.html', context)
 
 
+@conditional_page
 def standings_list(request):
     ''' Summary of current standings in the bet '''
     # Access the selected_year from the request object
@@ -255,144 +272,7 @@ def standings_list(request):
     current_datetime = timezone.now()
     selected_year = str(current_datetime.year)
 
-    users_with_bets = CustomUser.objects.filter(
-        bet__game__start_time__lt=current_datetime,
-        bet__game__start_time__year=selected_year,
-        bet__game__competition__excluded=False
-    ).distinct()
-
-    if selected_year == '2022':
-        table_points = {
-            1: 12,
-            2: 12,
-            3: 12,
-            4: 14,
-            5: 12,
-            6: 18,
-            7: 14,
-            8: 14,
-        }
-    elif selected_year == '2023':
-        competition = Competition.objects.get(pk=3)
-        sort_order_list = [int(team_id) for team_id in ALLSVENSKAN_2023.split(',')]
-        competition_standings = sorted(competition.teams.all(), key=lambda team: sort_order_list.index(team.id))
-    elif selected_year == '2024':
-        competition = Competition.objects.get(pk=8)
-        standings = Standing.objects.filter(competition=competition).prefetch_related('team_positions').latest('round')
-        sort_order_list = list(standings.team_positions.values_list('team_id', flat=True).order_by('position'))
-        competition_standings = sorted(competition.teams.all(), key=lambda team: sort_order_list.index(team.id))
-    elif selected_year == '2025':
-        competition = Competition.objects.get(pk=13)
-        standings = Standing.objects.filter(competition=competition).prefetch_related('team_positions').latest('round')
-        sort_order_list = list(standings.team_positions.values_list('team_id', flat=True).order_by('position'))
-        competition_standings = sorted(competition.teams.all(), key=lambda team: sort_order_list.index(team.id))
-    elif selected_year == '2026':
-        competition = Competition.objects.get(pk=17)
-        standings = Standing.objects.filter(competition=competition).prefetch_related('team_positions').latest('round')
-        sort_order_list = list(standings.team_positions.values_list('team_id', flat=True).order_by('position'))
-        competition_standings = sorted(competition.teams.all(), key=lambda team: sort_order_list.index(team.id))
-
-
-    result = []
-    for user in users_with_bets:
-        user_bets = Bet.objects.select_related('game', 'game__home_team', 'game__away_team').exclude(game__home_goals__isnull=True).filter(user=user.id, game__start_time__lt=current_datetime, game__start_time__year=selected_year, game__competition__excluded=False)
-        # print(user_bets)
-        points = 0
-        goal_diff = 0
-        goals_scored_diff = 0
-        for bet in user_bets:
-            points += bet.points
-            if bet.game.home_team.id == 1:
-                goal_diff += (bet.home_goals - bet.away_goals) - (bet.game.home_goals - bet.game.away_goals)
-                goals_scored_diff += bet.home_goals - bet.game.home_goals
-            else:
-                goal_diff += (bet.away_goals - bet.home_goals) - (bet.game.away_goals - bet.game.home_goals)
-                goals_scored_diff += bet.away_goals - bet.game.away_goals
-
-        if selected_year == '2022':
-            user_table_points = table_points.get(user.id, 0)
-            user_top_scorer = 'N/A'
-            user_most_assists = 'N/A'
-        elif selected_year == '2024':
-            user_standing_prediction = StandingPrediction.objects.get(user=user.id, competition=competition)
-            user_table_points = user_standing_prediction.calculate_points(standings, 4, 6, 2)
-            user_top_scorer = user_standing_prediction.top_scorer
-            user_most_assists = user_standing_prediction.most_assists
-        else:
-            user_table_points = 0
-            try:
-                user_standing_prediction = StandingPrediction.objects.select_related('user').prefetch_related('team_positions__team').get(user=user.id, competition=competition)
-                teams = [(standing_prediction_team.position, standing_prediction_team.team) for standing_prediction_team in user_standing_prediction.team_positions.all()]
-                user_top_scorer = user_standing_prediction.top_scorer
-                user_most_assists = user_standing_prediction.most_assists
-                user_most_points = user_standing_prediction.most_points
-                user_clean_sheets = user_standing_prediction.clean_sheets
-                bet_points = []
-                # for position, team in teams:
-                #     diff = position - competition_standings.index(team) - 1
-                #     bet_points.append(-abs(diff))
-                user_table_points = sum(bet_points)
-            except StandingPrediction.DoesNotExist:
-                user_top_scorer = 'N/A'
-                user_most_assists = 'N/A'
-                user_most_points = 'N/A'
-                user_clean_sheets = 'N/A'
-
-        result.append({
-            'user': user,
-            'points': points,
-            'table_points': user_table_points,
-            'top_scorer': user_top_scorer,
-            'most_assists': user_most_assists,
-            'most_points': user_most_points,
-            'clean_sheets': user_clean_sheets,
-            'goal_diff': goal_diff,
-            'goals_scored_diff': goals_scored_diff,
-        })
-
-    max_total = 0
-    top_scorer_list = []
-    most_assists_list = []
-    most_points_list = []
-    clean_sheets = []
-    if selected_year == '2023':
-        top_scorer_list = TOP_SCORER_2023
-        most_assists_list = MOST_ASSISTS_2023
-    elif selected_year in ('2024', '2025'):
-        top_scorer_list = standings.top_scorer
-        most_assists_list = standings.most_assists
-    elif selected_year in ('2026'):
-        most_points_list = standings.most_points
-        clean_sheets = standings.clean_sheets
-
-    for row in result:
-        row['extra_bet'] = 0
-        top_scorers = row['top_scorer'].split(', ')
-        top_assists = row['most_assists'].split(', ')
-        most_points = row['most_points'].split(', ')
-        user_clean_sheets = row['clean_sheets']
-
-        for top_scorer in top_scorers:
-            if top_scorer in top_scorer_list:
-                row['extra_bet'] += 6
-        for most_assist in top_assists:
-            if most_assist in most_assists_list:
-                row['extra_bet'] += 6
-        # for most_point in most_points:
-        #     if most_point in most_points_list:
-        #         row['extra_bet'] += 6
-        
-        # row['extra_bet'] += -abs(clean_sheets - user_clean_sheets) if clean_sheets and user_clean_sheets != 'N/A' else 0
-
-        total_points = row['points'] + row['table_points'] + row['extra_bet']
-        row['total_points'] = total_points
-        if total_points > max_total:
-            max_total = total_points
-
-    for row in result:
-        row['order'] = ((max_total - row['total_points']) * 100 + abs(row['goal_diff'])) * 100 + abs(row['goals_scored_diff'])
-
-    result.sort(key=lambda x: x['order'])
+    result = compute_standings(selected_year)
 
     if selected_year == '2022':
         prizes = {
@@ -410,18 +290,6 @@ def standings_list(request):
             '8-10': 'Betala för ovanstående och arrangera fest',
         }
 
-    count, rank = 0, 0
-    previous = None
-    for row in result:
-        current_value = row['order']
-        count += 1
-        if current_value != previous:
-            rank += count
-            previous = current_value
-            count = 0
-        row['rank'] = rank
-
-
     context = {'result': result, 'prizes': prizes, 'selected_year': selected_year}
     return render(request, 'betting/standings.html', context)
 
@@ -500,7 +368,7 @@ def standing_predictions_list(request, competition_id):
 
     if competition_id == 3:
         sort_order_list = [int(team_id) for team_id in ALLSVENSKAN_2023.split(',')]
-        current_standings = sorted(competition.teams.all(), key=lambda team: sort_order_list.index(team.id))
+        current_standings = ordered_standings(competition.teams.all(), sort_order_list)
         top_scorer = TOP_SCORER_2023
         most_assists = MOST_ASSISTS_2023
     else:
@@ -508,32 +376,8 @@ def standing_predictions_list(request, competition_id):
         top_scorer = ''
         most_assists = ''
 
-    standing_predictions = []
-    for standing_prediction in all_standing_predictions:
-        teams = [(standing_prediction_team.position, standing_prediction_team.team) for standing_prediction_team in standing_prediction.team_positions.all()]
-        user_top_scorer = standing_prediction.top_scorer
-        user_most_assists = standing_prediction.most_assists
-
-        bet_points = []
-        for position, team in teams:
-            diff = position - current_standings.index(team) - 1
-            bet_points.append(-abs(diff))
-        points = sum(bet_points)
-
-        standing_predictions.append({
-            'user': standing_prediction.user,
-            'teams': teams,
-            'bet_points': bet_points,
-            'points': points,
-            'top_scorer': user_top_scorer,
-            'most_assists': user_most_assists
-        })
-
-    teams = []
-    for i, team in enumerate(current_standings):
-        teams.append([((i+1, team), 0)])
-        for row in standing_predictions:
-            teams[i].append((row['teams'][i], row['bet_points'][i]))
+    standing_predictions = score_position_difference(current_standings, all_standing_predictions)
+    teams = standing_grid(current_standings, standing_predictions)
 
     # context = {'result_2022': result_2022, 'current_standings': current_standings, 'prizes_8': prizes_8, 'prizes_10': prizes_10}
     context = {'competition': competition, 'standing_predictions': standing_predictions, 'teams': teams, 'top_scorer': top_scorer, 'most_assists': most_assists}
@@ -726,74 +570,52 @@ def standing_predictions_suggestion(request, competition_id):
     return render(request, 'betting/standing_prediction_suggestion.html', context)
 
 
+@conditional_page
 def statistics(request, year):
     ''' Calculates statistics regarding the bet '''
-    current_datetime = timezone.now()
-
-    def recent_games(number_of_games):
-        return Game.objects.filter(start_time__lt=current_datetime, start_time__year=year, competition__excluded=False).order_by('-start_time')[:number_of_games].values('id')
-
-    stats_table = Bet.objects.values('user__first_name').filter(game__start_time__lt=current_datetime, game__start_time__year=year, game__competition__excluded=False).annotate(
-        total_bets=Count('user'),
-        total_points=Sum('points'),
-        average_points=Round(Avg('points'), 2),
-        zero_points=Count(Case(When(points=0, then=1), output_field=IntegerField())),
-        one_point=Count(Case(When(points=1, then=1), output_field=IntegerField())),
-        three_points=Count(Case(When(points=3, then=1), output_field=IntegerField())),
-        four_points=Count(Case(When(points=4, then=1), output_field=IntegerField())),
-        six_points=Count(Case(When(points=6, then=1), output_field=IntegerField())),
-        total_points_last_5=Sum('points', filter=Q(game__in=recent_games(5))),
-        average_points_last_5=Round(Avg('points', filter=Q(game__in=recent_games(5))), 2),
-        total_points_last_10=Sum('points', filter=Q(game__in=recent_games(10))),
-        average_points_last_10=Round(Avg('points', filter=Q(game__in=recent_games(10))), 2),
-        total_points_last_15=Sum('points', filter=Q(game__in=recent_games(15))),
-        average_points_last_15=Round(Avg('points', filter=Q(game__in=recent_games(15))), 2)
-    ).order_by('-total_points')
-
-    # Assuming you have a predefined list of user names or IDs
-    user_list = (Bet.objects
-        .values('user__id', 'user__first_name')
-        .filter(
-            game__start_time__lt=current_datetime,
-            game__start_time__year=year,
-            game__competition__excluded=False
-        )
-        .distinct()
-        .order_by('user__first_name')
-    )
-
-    # Dynamically generate the fields for each user's cumulative points
-    user_cumulative_points = {f'user_{user["user__id"]}_cumulative_points': Window(Sum('bets__points', filter=Q(bets__user__id=user['user__id'])), order_by='start_time') for user in user_list}
-
-    # Create the queryset
-    game_stats = (
-        Game.objects
-        .filter(start_time__lt=current_datetime, start_time__year=year, competition__excluded=False)
-        .prefetch_related('bets', 'bets__user')
-        .select_related('home_team', 'away_team')
-        .annotate(
-            **user_cumulative_points
-        )
-        .values('id', 'start_time', 'home_team__name', 'away_team__name', *user_cumulative_points.keys())
-        .distinct()
-        .order_by('start_time')
-    )
-
-    context = {'stats_table': stats_table, 'user_list': user_list, 'game_stats': game_stats}
+    context = get_statistics(year, timezone.now())
     return render(request, 'betting/statistics.html', context)
 
 
 class calendar_subscription(ICalFeed):
-    ''' A calendar feed with all the games '''
+    ''' A calendar feed with all the games, optionally filtered by ?competition= and ?season= '''
     product_id = '-//Bettingkingarna//All games//SV'
     timezone = 'Europe/Stockholm'
     file_name = "feed.ics"
     title = "Bettingkingarna"
     description = "Alla inlagda matcher för Bettingkingarna"
 
-    def items(self):
-        ''' Return all games '''
-        return Game.objects.filter(competition__excluded=False)
+    def __call__(self, request, *args, **kwargs):
+        ''' Serves the feed from the bytes rendered once per data version and filter '''
+        filters = self.get_object(request)
+        content, content_type = cached(
+            'calendar', ALL, request.get_host(), filters['competition'], filters['season'],
+            compute=lambda: self.render(request, *args, **kwargs)
+        )
+        response = HttpResponse(content, content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{self.file_name}"'
+        return response
+
+    def render(self, request, *args, **kwargs):
+        response = super().__call__(request, *args, **kwargs)
+        return response.content, response['Content-Type']
+
+    def get_object(self, request, *args, **kwargs):
+        ''' Return the filters given in the query string '''
+        competition = request.GET.get('competition', '')
+        return {
+            'competition': int(competition) if competition.isdigit() else None,
+            'season': request.GET.get('season') or None,
+        }
+
+    def items(self, filters):
+        ''' Return all games matching the filters '''
+        games = Game.objects.filter(competition__excluded=False).select_related('competition', 'home_team', 'away_team')
+        if filters['competition'] is not None:
+            games = games.filter(competition=filters['competition'])
+        if filters['season'] is not None:
+            games = games.filter(competition__season=filters['season'])
+        return games
 
     def item_guid(self, item):
         ''' Setting a UID for each item '''
@@ -814,6 +636,78 @@ class calendar_subscription(ICalFeed):
         return item.start_time + timezone.timedelta(hours=2)
 
 
+def calendar_etag(request, *args, **kwargs):
+    return f'{get_version(ALL)}-{request.get_host()}-{request.GET.urlencode()}'
+
+
+calendar_feed = condition(etag_func=calendar_etag)(calendar_subscription())
+
+
+def deadline_calendar_token(user):
+    ''' Returns the signed token identifying the user in the url of the personal deadline calendar '''
+    return signing.dumps(user.pk, salt=DEADLINE_CALENDAR_SALT)
+
+
+class deadline_calendar_subscription(calendar_subscription):
+    ''' A calendar feed with the personal betting deadline of a user for every game of the current and coming seasons '''
+    product_id = '-//Bettingkingarna//Deadlines//SV'
+    file_name = "deadlines.ics"
+    title = "Bettingkingarna deadlines"
+    description = "Dina deadlines för Bettingkingarna"
+
+    def __call__(self, request, token):
+        ''' Serves the feed of the user in the token from the bytes rendered once per data version '''
+        content, content_type = cached(
+            'deadline-calendar', ALL, request.get_host(), self.get_user_id(token),
+            compute=lambda: self.render(request, token)
+        )
+        response = HttpResponse(content, content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{self.file_name}"'
+        return response
+
+    def get_user_id(self, token):
+        ''' Return the id of the user the token was signed for '''
+        try:
+            return signing.loads(token, salt=DEADLINE_CALENDAR_SALT)
+        except signing.BadSignature:
+            raise Http404('Invalid calendar token.')
+
+    def get_object(self, request, token):
+        ''' Return the user identified by the token '''
+        return get_object_or_404(CustomUser, pk=self.get_user_id(token))
+
+    def items(self, user):
+        ''' Return the games with the stored deadline of the user attached '''
+        games = Game.objects.filter(
+            competition__excluded=False,
+            start_time__year__gte=timezone.now().year
+        ).select_related('competition', 'home_team', 'away_team').order_by('start_time')
+        return games.with_deadlines(user)
+
+    def item_guid(self, item):
+        return f'Deadline-{item.id}@Bettingkingarna'
+
+    def item_title(self, item):
+        return f'Deadline: {item}'
+
+    def item_description(self, item):
+        return f'{item.competition}, avspark {timezone.localtime(item.start_time):%H:%M}'
+
+    def item_start_datetime(self, item):
+        ''' The personal deadline of the user '''
+        return item.user_deadline
+
+    def item_end_datetime(self, item):
+        return item.start_time
+
+
+def deadline_calendar_etag(request, token):
+    return f'{get_version(ALL)}-{request.get_host()}-{token}'
+
+
+deadline_calendar_feed = condition(etag_func=deadline_calendar_etag)(deadline_calendar_subscription())
+
+
 @login_required(login_url='betting:login')
 def table_bet(request, competition_id):
     ''' Show bet for current user for a specific competition standings '''
@@ -904,6 +798,7 @@ def table_bet(request, competition_id):
     return render(request, 'betting/table_bet.html', context)
 
 
+@conditional_page
 def table_bet_summary(request, competition_id):
     ''' Show all bets regarding the current standings for a specific competition '''
     competition = get_object_or_404(Competition.objects.prefetch_related('teams'), pk=competition_id)
@@ -913,7 +808,9 @@ def table_bet_summary(request, competition_id):
     TOP_BOTTOM = 0
     POINTS_CORRECT = 0
     POINTS_ALMOST = 0
-    standings = Standing.objects.filter(competition=competition).prefetch_related('team_positions').latest('round')
+    most_points = ''
+    clean_sheets = ''
+    standings = Standing.objects.filter(competition=competition).latest('round')
 
     if competition_id == 1 or competition_id == 8:
         if competition_id == 1: # Allsvenskan 2022
@@ -931,158 +828,48 @@ def table_bet_summary(request, competition_id):
             POINTS_CORRECT = 6
             POINTS_ALMOST = 2
 
-        current_standings = sorted(competition.teams.all(), key=lambda team: sort_order_list.index(team.id))
-        current_standings = [(pos, team) for pos, team in enumerate(current_standings, 1)]
-        current_top_teams = current_standings[:TOP_BOTTOM]
-        current_bottom_teams = current_standings[-TOP_BOTTOM:]
-
-        standing_predictions = []
-        for standing_prediction in all_standing_predictions:
-            teams = [(standing_prediction_team.position, standing_prediction_team.team) for standing_prediction_team in standing_prediction.team_positions.all()]
-            user_top_scorer = standing_prediction.top_scorer
-            user_most_assists = standing_prediction.most_assists
-
-            top_teams = teams[:TOP_BOTTOM]
-            bottom_teams = teams[-TOP_BOTTOM:]
-
-            teams = top_teams + bottom_teams
-
-            bet_points = []
-            for position, team in top_teams:
-                points = 0
-                if (position, team) in current_top_teams:
-                    points = POINTS_CORRECT
-                elif team in [tup[1] for tup in current_top_teams]:
-                    points = POINTS_ALMOST
-                bet_points.append(points)
-
-            for position, team in bottom_teams:
-                points = 0
-                if (position, team) in current_bottom_teams:
-                    points = POINTS_CORRECT
-                elif team in [tup[1] for tup in current_bottom_teams]:
-                    points = POINTS_ALMOST
-                bet_points.append(points)
-
-            points = standing_prediction.calculate_points(standings, TOP_BOTTOM, POINTS_CORRECT, POINTS_ALMOST)
-
-            standing_predictions.append({
-                'user': standing_prediction.user,
-                'teams': teams,
-                'top_teams': top_teams,
-                'bottom_teams': bottom_teams,
-                'bet_points': bet_points,
-                'points': points,
-                'top_scorer': user_top_scorer,
-                'most_assists': user_most_assists
-            })
+        current_standings = ordered_standings(competition.teams.all(), sort_order_list)
+        standing_predictions = score_top_bottom(current_standings, all_standing_predictions, TOP_BOTTOM, POINTS_CORRECT, POINTS_ALMOST)
+        points = StandingPrediction.calculate_points_for_competition(competition, standings, TOP_BOTTOM, POINTS_CORRECT, POINTS_ALMOST)
+        for row in standing_predictions:
+            row['points'] = points.get(row['user'], 0)
 
         # Hide all standing predictions if the competition has not started yet
         if competition_id == 8 and timezone.now() < DEADLINE_2024:
             standing_predictions = []
 
-        teams = []
-
-        current_standings = current_standings[:TOP_BOTTOM] + current_standings[-TOP_BOTTOM:]
-        current_standings = [[((position, team), 0)] for position, team in current_standings]
-
-        for i, _ in enumerate(current_standings):
-            for row in standing_predictions:
-                current_standings[i].append((row['teams'][i], row['bet_points'][i]))
+        current_standings = standing_grid(current_standings[:TOP_BOTTOM] + current_standings[-TOP_BOTTOM:], standing_predictions)
 
     elif competition_id == 3: # Allsvenskan 2023
         sort_order_list = [int(team_id) for team_id in ALLSVENSKAN_2023.split(',')]
-        current_standings = sorted(competition.teams.all(), key=lambda team: sort_order_list.index(team.id))
+        current_standings = ordered_standings(competition.teams.all(), sort_order_list)
         top_scorer = TOP_SCORER_2023
         most_assists = MOST_ASSISTS_2023
 
-        standing_predictions = []
-        for standing_prediction in all_standing_predictions:
-            teams = [(standing_prediction_team.position, standing_prediction_team.team) for standing_prediction_team in standing_prediction.team_positions.all()]
-            user_top_scorer = standing_prediction.top_scorer
-            user_most_assists = standing_prediction.most_assists
-
-            bet_points = []
-            for position, team in teams:
-                diff = position - current_standings.index(team) - 1
-                bet_points.append(-abs(diff))
-            points = sum(bet_points)
-
-            standing_predictions.append({
-                'user': standing_prediction.user,
-                'teams': teams,
-                'bet_points': bet_points,
-                'points': points,
-                'top_scorer': user_top_scorer,
-                'most_assists': user_most_assists
-            })
-
-        teams = []
-        for i, team in enumerate(current_standings):
-            teams.append([((i+1, team), 0)])
-            for row in standing_predictions:
-                teams[i].append((row['teams'][i], row['bet_points'][i]))
+        standing_predictions = score_position_difference(current_standings, all_standing_predictions)
+        current_standings = standing_grid(current_standings, standing_predictions)
 
-        current_standings = teams
-    
     elif competition_id in (13, 17): # Allsvenskan 2025 and 2026
         sort_order_list = list(standings.team_positions.values_list('team_id', flat=True).order_by('position'))
         top_scorer = standings.top_scorer
         most_assists = standings.most_assists
         most_points = standings.most_points
         clean_sheets = standings.clean_sheets
-    
-        current_standings = sorted(competition.teams.all(), key=lambda team: sort_order_list.index(team.id))
 
-        standing_predictions = []
-        for standing_prediction in all_standing_predictions:
-            teams = [(standing_prediction_team.position, standing_prediction_team.team) for standing_prediction_team in standing_prediction.team_positions.all()]
-            user_top_scorer = standing_prediction.top_scorer
-            user_most_assists = standing_prediction.most_assists
-            user_most_points = standing_prediction.most_points
-            user_clean_sheets = standing_prediction.clean_sheets
-
-            bet_points = []
-            for position, team in teams:
-                diff = position - current_standings.index(team) - 1
-                bet_points.append(-abs(diff))
-            points = sum(bet_points)
-
-            standing_predictions.append({
-                'user': standing_prediction.user,
-                'teams': teams,
-                'bet_points': bet_points,
-                'points': points,
-                'top_scorer': user_top_scorer,
-                'most_assists': user_most_assists,
-                'most_points': user_most_points,
-                'clean_sheets': user_clean_sheets
-            })
+        current_standings = ordered_standings(competition.teams.all(), sort_order_list)
+        standing_predictions = score_position_difference(current_standings, all_standing_predictions)
 
         # Hide all standing predictions if the competition has not started yet
         if (competition_id == 13 and timezone.now() < DEADLINE_2025) or \
            (competition_id == 17 and timezone.now() < DEADLINE_2026):
             standing_predictions = []
 
-        teams = []
+        current_standings = position_grid(current_standings, standing_predictions)
 
-        current_standings = [[((position, team), 0)] for position, team in enumerate(current_standings, 1)]
-
-        for i, _ in enumerate(current_standings):
-            for row in standing_predictions:
-                for position, team in row['teams']:
-                    list_position = row['teams'].index((position, team))
-                    if i + 1 == position:
-                        current_standings[i].append(((position, team), row['bet_points'][list_position]))
-                    else:
-                        current_standings[i].append(((i + 1, ), ))
-    
     else:
         current_standings = []
         top_scorer = ''
         most_assists = ''
-        most_points = ''
-        clean_sheets = ''
         standing_predictions = []
 
     team_positions = TeamPosition.objects.filter(standing__competition=competition).values(
@@ -1115,6 +902,7 @@ def table_bet_summary(request, competition_id):
     return render(request, 'betting/table_bet_summary.html', context)
 
 @login_required(login_url='betting:login')
+@conditional_page
 def competition_overview(request, competition_id):
     ''' Show the games and bet results for a specific competition '''
     current_datetime = timezone.now()
@@ -1209,14 +997,15 @@ def competition_overview(request, competition_id):
 
     current_standing_game = upcoming_game if upcoming_game else latest_game
 
-    current_standing = current_standing_game.get_leaderboard()
+    leaderboard_index = get_leaderboard_index(current_standing_game)
+    current_standing = leaderboard_index.leaderboard_for(current_standing_game)
 
     second_latest_game = Game.objects.filter(
         start_time__lt=current_standing_game.start_time,
         competition=competition
     ).order_by('start_time').last()
 
-    previous_standing = second_latest_game.get_leaderboard() if second_latest_game else None
+    previous_standing = leaderboard_index.leaderboard_for(second_latest_game) if second_latest_game else None
 
     user_data_dict = {}
     for data in current_standing:
@@ -1245,10 +1034,11 @@ def competition_overview(request, competition_id):
 
     past_games, current_games, upcoming_games = [], [], []
 
-    for game in all_games:
+    for game in all_games.with_deadlines(request.user):
         game_info = {
             'game': game,
-            'user_has_bet': game.id in user_bets
+            'user_has_bet': game.id in user_bets,
+            'deadline': game.user_deadline,
         }
 
         if game.start_time.date() == current_datetime.date() or current_datetime - timezone.timedelta(hours=12) <= game.start_time <= current_datetime + timezone.timedelta(hours=24):
@@ -1268,71 +1058,44 @@ def competition_overview(request, competition_id):
     }
     return render(request, 'betting/competition_overview.html', context)
 
-def chart_data_view(request, competition_id):
-    ''' Returns a json object with the data for a specific competition '''
-    current_datetime = timezone.now()
-    data = Bet.objects.filter(game__competition=competition_id, game__start_time__lt=current_datetime).annotate(
-        game_start_time=F('game__start_time')
-    ).annotate(
-        cumulative_points=Window(
-            expression=Sum('points'),
-            partition_by=F('user'),
-            order_by=F('game__start_time').asc()
-        )
-    ).values('user__first_name', 'game_start_time', 'cumulative_points').order_by('user', 'game_start_time')
+def chart_state_for_request(request, competition_id):
+    ''' Returns the chart state of the competition, computed once per request '''
+    if not hasattr(request, 'chart_state'):
+        request.chart_state = chart_state(competition_id, timezone.now())
+    return request.chart_state
 
-    for item in data:
-        item['game_start_time'] = item['game_start_time'].strftime('%Y-%m-%d %H:%M')
 
-    # Structure data for Chart.js
-    chart_data = {
-        'labels': [],
-        'datasets': []
-    }
+def chart_data_etag(request, competition_id):
+    started_games, last_modified = chart_state_for_request(request, competition_id)
+    version = last_modified.timestamp() if last_modified else 0
+    return f'{competition_id}-{started_games}-{version}-{request.GET.get("encoding", "absolute")}'
 
-    # Get unique start times for the labels
-    unique_start_times = sorted(set(item['game_start_time'] for item in data))
-    chart_data['labels'] = unique_start_times
 
-    # Prepare datasets for each user
-    user_points = {}
-    for item in data:
-        user = item['user__first_name']
-        if user not in user_points:
-            user_points[user] = {
-                'label': user,
-                'data': [None] * len(unique_start_times),
-                # 'borderColor': f'rgba({hash(user) % 255}, {(hash(user) // 2) % 255}, {(hash(user) // 3) % 255}, 1)',
-                'fill': False,
-            }
-        index = unique_start_times.index(item['game_start_time'])
-        user_points[user]['data'][index] = item['cumulative_points']
+def chart_data_last_modified(request, competition_id):
+    return chart_state_for_request(request, competition_id)[1]
 
-    chart_data['datasets'] = list(user_points.values())
 
-    return JsonResponse(chart_data)
+@condition(etag_func=chart_data_etag, last_modified_func=chart_data_last_modified)
+def chart_data_view(request, competition_id):
+    ''' Returns a json object with the data for a specific competition '''
+    encoding = 'delta' if request.GET.get('encoding') == 'delta' else 'absolute'
+    return JsonResponse(get_chart_data(competition_id, timezone.now(), encoding))
 
 
 def world_cup_bet(request, competition_id):
     ''' Show bet for current user for a specific competition standings '''
     competition = get_object_or_404(Competition, pk=competition_id)
 
-    users_with_bets = CustomUser.objects.filter(
-        standingprediction__competition=competition
-    ).distinct().order_by('first_name')
+    all_standing_predictions = StandingPrediction.objects.select_related('user').prefetch_related('team_positions__team').filter(competition=competition).order_by('user__first_name')
 
     result = {}
 
-    for user in users_with_bets:
-        user_bet = StandingPrediction.objects.get(user=user, competition=competition)
-        teams = StandingPredictionTeam.objects.filter(standing_prediction=user_bet).prefetch_related('team').order_by('position')
-        for team in teams:
-            winner = team.team.name
-        top_scorer = user_bet.top_scorer
-        result[user.id] = {
-            'user': user,
-            'winner': winner,
-            'top_scorer': top_scorer
+    for user_bet in all_standing_predictions:
+        teams = sorted(user_bet.team_positions.all(), key=lambda team: team.position)
+        result[user_bet.user_id] = {
+            'user': user_bet.user,
+            'winner': teams[-1].team.name if teams else '',
+            'top_scorer': user_bet.top_scorer
         }
 
     context = {
@@ -1341,3 +1104,75 @@ def world_cup_bet(request, competition_id):
     }
 
     return render(request, 'betting/world_cup_bet.html', context)
+
+
+@staff_member_required(login_url='betting:login')
+def cache_stats(request):
+    ''' Shows the hit and miss counters of the leaderboard cache '''
+    return JsonResponse(betting_cache_stats())
+
+
+@staff_member_required(login_url='betting:login')
+def slow_queries(request):
+    ''' Shows the slow queries of this process grouped by shape, the most recent ones with their stacks and the allocation profiles '''
+    context = {
+        'shapes': slow_query_summary(),
+        'recent_queries': list(reversed(recent_slow_queries))[:20],
+        'threshold': settings.SLOW_QUERY_THRESHOLD_MS,
+        'allocation_profiles': list(reversed(allocation_profiles)),
+    }
+    return render(request, 'betting/slow_queries.html', context)
+
+
+@staff_member_required(login_url='betting:login')
+def profiler_page(request):
+    ''' Switches the sampling profiler on for a view during some minutes, or off, and shows its state '''
+    if request.method == 'POST':
+        action = request.POST.get('action')
+        if action == 'start':
+            try:
+                minutes = min(max(int(request.POST.get('minutes') or 5), 1), 60)
+            except ValueError:
+                messages.error(request, 'Ange antalet minuter som ett heltal mellan 1 och 60.')
+                return redirect('betting:profiler')
+            profiler.start_profiling(request.POST.get('url_name', ''), minutes * 60)
+        elif action == 'stop':
+            profiler.stop_profiling()
+        elif action == 'clear':
+            profiler.clear_stacks()
+        return redirect('betting:profiler')
+
+    from .urls import urlpatterns
+    target = profiler.profiling_target()
+    context = {
+        'target': target,
+        'until': target and timezone.datetime.fromtimestamp(target['until'], tz=timezone.get_current_timezone()),
+        'url_names': sorted(f'betting:{pattern.name}' for pattern in urlpatterns),
+        'samples': profiler.sample_count(),
+    }
+    return render(request, 'betting/profiler.html', context)
+
+
+@staff_member_required(login_url='betting:login')
+def profiler_stacks(request):
+    ''' Downloads the sampled stacks in the folded flamegraph format '''
+    response = HttpResponse(profiler.folded_stacks(), content_type='text/plain; charset=utf-8')
+    response['Content-Disposition'] = 'attachment; filename="stacks.txt"'
+    return response
+
+
+def has_metrics_token(request):
+    ''' True for requests from internal addresses with the METRICS_TOKEN as bearer token
+
+    The address alone is not enough, since every request arrives from 127.0.0.1 behind a local reverse proxy.
+    '''
+    if not settings.METRICS_TOKEN or request.META.get('REMOTE_ADDR') not in settings.INTERNAL_IPS:
+        return False
+    return constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {settings.METRICS_TOKEN}')
+
+
+def metrics(request):
+    ''' Returns the metrics of all workers in the Prometheus text format, to staff and to scrapers at internal addresses with the metrics token '''
+    if not request.user.is_staff and not has_metrics_token(request):
+        return HttpResponseForbidden()
+    return HttpResponse(betting_metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
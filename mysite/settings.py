@@ -11,7 +11,7 @@ https://docs.djangoproject.com/en/4.1/ref/settings/
 """
 
 from pathlib import Path
-from decouple import config
+from decouple import config, Csv
 from django.contrib.messages import constants as messages
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -45,6 +45,11 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'betting.middleware.MetricsMiddleware',
+    'betting.middleware.ServerTimingMiddleware',
+    'betting.middleware.SlowQueryMiddleware',
+    'betting.middleware.AllocationProfilingMiddleware',
+    'betting.middleware.SamplingProfilerMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -59,7 +64,7 @@ ROOT_URLCONF = 'mysite.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'betting.middleware.TimedDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -83,10 +88,48 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Keep connections between requests, checking them before reuse
+        'CONN_MAX_AGE': 60,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            # Take the write lock when a transaction starts, instead of failing to upgrade a read lock while others write
+            'transaction_mode': 'IMMEDIATE',
+        },
+    }
+}
+
+# Applied to every new SQLite connection by betting.db
+
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'cache_size': -20000,
+    'mmap_size': 128 * 1024 * 1024,
+}
+
+
+# Cache shared by all worker processes of the host
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'betting.cache_backend.SQLiteCache',
+        # Not in a shared temporary directory, since the cached entries are unpickled and hold user objects
+        'LOCATION': config('CACHE_LOCATION', default=str(BASE_DIR / 'cache.sqlite3')),
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
     }
 }
 
 
+# Keeps the files written during tests out of the project and the temporary files of a running server
+
+TEST_RUNNER = 'mysite.test_runner.TestRunner'
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 
@@ -158,3 +201,60 @@ MESSAGE_TAGS = {
 INTERNAL_IPS = [
     "127.0.0.1",
 ]
+
+# Share of requests timed by betting.middleware.ServerTimingMiddleware, with a
+# Server-Timing header and a line in the timing log
+
+REQUEST_TIMING_SAMPLE_RATE = config('REQUEST_TIMING_SAMPLE_RATE', default=0.1, cast=float)
+
+# Queries at least this slow are kept, up to the buffer size per process, for the slow query page
+
+SLOW_QUERY_THRESHOLD_MS = config('SLOW_QUERY_THRESHOLD_MS', default=100, cast=float)
+SLOW_QUERY_BUFFER_SIZE = 200
+
+# Views, by URL name like betting:statistics, whose memory allocations are traced for a share of
+# the requests and logged with the top allocating lines
+
+ALLOCATION_PROFILING_URL_NAMES = config('ALLOCATION_PROFILING_URL_NAMES', default='', cast=Csv())
+ALLOCATION_PROFILING_SAMPLE_RATE = config('ALLOCATION_PROFILING_SAMPLE_RATE', default=0.1, cast=float)
+ALLOCATION_PROFILING_TOP_LINES = 10
+
+# Every worker writes its betting.metrics here, the /metrics endpoint adds them up
+
+METRICS_DIR = config('METRICS_DIR', default=str(BASE_DIR / 'metrics'))
+
+# Scrapers at INTERNAL_IPS send this as bearer token to read /metrics, staff can always read it
+
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'message': {
+            'format': '%(message)s',
+        },
+    },
+    'handlers': {
+        'timing': {
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': config('REQUEST_TIMING_LOG', default=str(BASE_DIR / 'timing.log')),
+            'maxBytes': 5 * 1024 * 1024,
+            'backupCount': 3,
+            'delay': True,
+            'formatter': 'message',
+        },
+    },
+    'loggers': {
+        'betting.timing': {
+            'handlers': ['timing'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        'betting.allocations': {
+            'handlers': ['timing'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
@@ -0,0 +1,38 @@
+import atexit
+import copy
+import logging.config
+import os
+import tempfile
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+from betting import metrics
+
+
+class TestRunner(DiscoverRunner):
+    ''' Runs the tests with the files the site writes in a temporary directory, apart from a server running on the same host '''
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.directory = tempfile.TemporaryDirectory(prefix='bettingkingarna-tests-')
+        logging_config = copy.deepcopy(settings.LOGGING)
+        logging_config['handlers']['timing']['filename'] = os.path.join(self.directory.name, 'timing.log')
+        logging.config.dictConfig(logging_config)
+        caches = copy.deepcopy(settings.CACHES)
+        caches['default']['LOCATION'] = os.path.join(self.directory.name, 'cache.sqlite3')
+        self.settings_override = override_settings(
+            CACHES=caches,
+            METRICS_DIR=os.path.join(self.directory.name, 'metrics'),
+        )
+        self.settings_override.enable()
+        # The metrics of the test process are written at exit, after the temporary directory is gone
+        atexit.unregister(metrics.flush)
+
+    def teardown_test_environment(self, **kwargs):
+        # Closes the handlers writing to the temporary directory
+        logging.config.dictConfig(settings.LOGGING)
+        self.settings_override.disable()
+        self.directory.cleanup()
+        super().teardown_test_environment(**kwargs)
@@ -18,8 +18,11 @@ from django.urls import include, path
 from django.conf import settings
 from django.conf.urls.static import static
 
+from betting import views as betting_views
+
 urlpatterns = [
     path('betting/', include('betting.urls')),
     path('admin/', admin.site.urls),
+    path('metrics', betting_views.metrics, name='metrics'),
     path('__debug__/', include('debug_toolbar.urls')),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)